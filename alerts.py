@@ -0,0 +1,199 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/alerts.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+ALERTS_PATH = os.getenv('ALERTS_PATH', os.path.join('data', 'alerts.json'))
+MAX_ALERTS_PER_CHAT = 50
+
+# /alert pepe > 0.000012    /alert XFOR rsi<30
+ALERT_PATTERN = re.compile(
+    r'^/alert(?:@\w+)?\s+([A-Za-z0-9.\-]+)\s+(?:(price|rsi)\s*)?([<>])\s*(\d*\.?\d+(?:[eE]-?\d+)?)\s*$',
+    re.IGNORECASE
+)
+
+class AlertError(Exception):
+    """Raised for alert commands that can't be parsed or accepted."""
+    pass
+
+def parse_alert_command(text: str) -> Tuple[str, str, str, float]:
+    """Parse '/alert <symbol> [price|rsi] <|> <value>' into (symbol, metric, op, threshold)."""
+    match = ALERT_PATTERN.match(text.strip())
+    if not match:
+        raise AlertError("Usage: /alert <symbol> > <price>, or /alert <ticker> rsi<30")
+    symbol, metric, op, threshold = match.groups()
+    return symbol, (metric or "price").lower(), op, float(threshold)
+
+class AlertBook:
+    """
+    Subscriber alerts indexed per (symbol, metric, direction) as sorted
+    threshold lists, so a move from `prev` to `value` only touches the alerts
+    whose thresholds lie in between (found with bisect). Alerts are one-shot:
+    they are removed when they fire. Every change is persisted to `path`.
+    """
+    def __init__(self, path: Optional[str] = ALERTS_PATH):
+        self.path = path
+        self.alerts = {}       # id -> alert dict
+        self.index = {}        # (symbol, metric, op) -> ([thresholds], [ids]) sorted by threshold
+        self.last_values = {}  # (symbol, metric) -> last observed value
+        self.watched = {}      # kind -> {symbol: {metric: alert count}}
+        self.by_chat = {}      # chat_id -> set of alert ids
+        self.lock = threading.Lock()
+
+    def _insert(self, alert: Dict) -> None:
+        thresholds, ids = self.index.setdefault((alert["symbol"], alert["metric"], alert["op"]), ([], []))
+        i = bisect.bisect_right(thresholds, alert["threshold"])
+        thresholds.insert(i, alert["threshold"])
+        ids.insert(i, alert["id"])
+        self.alerts[alert["id"]] = alert
+        metrics = self.watched.setdefault(alert["kind"], {}).setdefault(alert["symbol"], {})
+        metrics[alert["metric"]] = metrics.get(alert["metric"], 0) + 1
+        self.by_chat.setdefault(alert["chat_id"], set()).add(alert["id"])
+
+    def _delete(self, alert: Dict) -> None:
+        key = (alert["symbol"], alert["metric"], alert["op"])
+        thresholds, ids = self.index[key]
+        lo = bisect.bisect_left(thresholds, alert["threshold"])
+        hi = bisect.bisect_right(thresholds, alert["threshold"])
+        i = ids.index(alert["id"], lo, hi)
+        del thresholds[i]
+        del ids[i]
+        if not ids:
+            del self.index[key]
+        del self.alerts[alert["id"]]
+
+        symbols = self.watched[alert["kind"]]
+        metrics = symbols[alert["symbol"]]
+        metrics[alert["metric"]] -= 1
+        if not metrics[alert["metric"]]:
+            del metrics[alert["metric"]]
+            if not metrics:
+                del symbols[alert["symbol"]]
+        chat_ids = self.by_chat[alert["chat_id"]]
+        chat_ids.discard(alert["id"])
+        if not chat_ids:
+            del self.by_chat[alert["chat_id"]]
+
+    def add(self, chat_id, symbol: str, kind: str, metric: str, op: str, threshold: float) -> Dict:
+        with self.lock:
+            if len(self.by_chat.get(chat_id, ())) >= MAX_ALERTS_PER_CHAT:
+                raise AlertError(f"You already have {MAX_ALERTS_PER_CHAT} alerts, remove some with /unalert")
+            alert = {
+                "id": uuid.uuid4().hex[:8],
+                "chat_id": chat_id,
+                "symbol": symbol,
+                "kind": kind,
+                "metric": metric,
+                "op": op,
+                "threshold": threshold,
+                "created_at": time.time()
+            }
+            self._insert(alert)
+            self._save()
+        logger.info(f"Added alert {alert['id']}: {symbol} {metric} {op} {threshold} for chat {chat_id}")
+        return alert
+
+    def remove(self, alert_id: str, chat_id) -> bool:
+        with self.lock:
+            alert = self.alerts.get(alert_id)
+            if not alert or alert["chat_id"] != chat_id:
+                return False
+            self._delete(alert)
+            self._save()
+        return True
+
+    def for_chat(self, chat_id) -> List[Dict]:
+        with self.lock:
+            alerts = [dict(self.alerts[alert_id]) for alert_id in self.by_chat.get(chat_id, ())]
+        return sorted(alerts, key=lambda a: a["created_at"])
+
+    def symbols(self, kind: str) -> Dict[str, set]:
+        """Symbols of `kind` that have alerts, mapped to the metrics they watch."""
+        with self.lock:
+            return {symbol: set(metrics) for symbol, metrics in self.watched.get(kind, {}).items()}
+
+    def update(self, symbol: str, metric: str, value: float) -> List[Dict]:
+        """Record a new value and remove and return every alert it crossed."""
+        with self.lock:
+            prev = self.last_values.get((symbol, metric))
+            self.last_values[(symbol, metric)] = value
+            fired = []
+
+            # '>' fires for thresholds in (prev, value]
+            entry = self.index.get((symbol, metric, ">"))
+            if entry:
+                thresholds, ids = entry
+                lo = bisect.bisect_right(thresholds, prev) if prev is not None else 0
+                hi = bisect.bisect_right(thresholds, value)
+                fired.extend(ids[lo:hi])
+
+            # '<' fires for thresholds in [value, prev)
+            entry = self.index.get((symbol, metric, "<"))
+            if entry:
+                thresholds, ids = entry
+                lo = bisect.bisect_left(thresholds, value)
+                hi = bisect.bisect_left(thresholds, prev) if prev is not None else len(thresholds)
+                fired.extend(ids[lo:hi])
+
+            if not fired:
+                return []
+            alerts = [self.alerts[alert_id] for alert_id in fired]
+            for alert in alerts:
+                self._delete(alert)
+            self._save()
+        return alerts
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with atomic_write(self.path) as f:
+                json.dump(list(self.alerts.values()), f)
+        except Exception as e:
+            logger.error(f"Failed to save alerts: {str(e)}")
+
+    @classmethod
+    def load(cls, path: str = ALERTS_PATH) -> "AlertBook":
+        book = cls(path)
+        try:
+            with open(path) as f:
+                for alert in json.load(f):
+                    book._insert(alert)
+            logger.info(f"Loaded {len(book.alerts)} alerts")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Could not load alerts from {path}: {str(e)}")
+        return book
+
+def format_alert(alert: Dict) -> str:
+    symbol = alert["symbol"].upper()
+    metric = "" if alert["metric"] == "price" else f" {alert['metric'].upper()}"
+    return f"`{alert['id']}` {symbol}{metric} {alert['op']} {alert['threshold']:g}"
+
+def fire_alerts(alerts: List[Dict], value: float, notify: Callable) -> None:
+    """Send each fired alert to its chat through `notify(chat_id, text)`."""
+    for alert in alerts:
+        try:
+            notify(alert["chat_id"], f"🚨 Alert hit: {format_alert(alert)} (now {value:g})")
+            logger.info(f"Fired alert {alert['id']} at {value}")
+        except Exception as e:
+            logger.error(f"Failed to deliver alert {alert['id']}: {str(e)}")
@@ -1,18 +1,28 @@
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 import os
 import sys
-import requests
 import logging
 import time
+import threading
 from functools import wraps
 from datetime import datetime
+from collections import OrderedDict
 
-from stock import fetch_stock_data, generate_chart, ask_chatgpt
-from memecoin import nova_memesnipe
-from telegram import handle_telegram_command, nova_joke, get_finance_news, send_welcome_dm
-from paypal import verify_ipn
+from stock import fetch_stock_data, generate_chart, ask_chatgpt, fetch_polygon_price
+from memecoin import nova_memesnipe, cache_stats, poll_price_history, price_listeners, fetch_market_snapshot
+from telegram import handle_telegram_command, nova_joke, get_finance_news, WELCOME_MESSAGE
+from paypal import validate_ipn_data, process_ipn, ipn_outbox
+from worker import CommandQueue, ReplyHandoff, SingleFlight
+from pipeline import StageGraph, StageError
+from alerts import AlertBook, AlertError, parse_alert_command, format_alert, fire_alerts
+from dedupe import SeenUpdates
+from broadcast import Broadcaster, Subscribers, StreamingReply, call_telegram, send_with_retry, send_photo, file_id_cache
+from poller import UpdatePoller
+from llm import response_cache
+from jokes import joke_pool
+import quota
 
 # --- Setup Logging ---
 logging.basicConfig(
@@ -27,33 +37,54 @@ logger = logging.getLogger(__name__)
 
 # --- Rate Limiting ---
 class RateLimit:
-    def __init__(self, max_requests=30, window=60):  # 30 requests per minute
+    """
+    Sliding-window-counter limiter. Each key keeps only this window's and the
+    previous window's counts, so a check is O(1), and at most `max_keys` keys
+    are tracked (least recently seen are dropped first).
+    """
+    def __init__(self, max_requests=30, window=60, max_keys=10000):  # 30 requests per minute
         self.max_requests = max_requests
         self.window = window
-        self.requests = {}
+        self.max_keys = max_keys
+        self.requests = OrderedDict()  # key -> [window_start, current_count, previous_count]
+        self.lock = threading.Lock()
         
     def is_allowed(self, key):
         now = time.time()
-        self.cleanup(now)
-        
-        if key not in self.requests:
-            self.requests[key] = []
-            
-        self.requests[key].append(now)
-        return len(self.requests[key]) <= self.max_requests
-        
-    def cleanup(self, now):
-        for key in list(self.requests.keys()):
-            self.requests[key] = [t for t in self.requests[key] if t > now - self.window]
-            if not self.requests[key]:
-                del self.requests[key]
+        window_start = now - now % self.window
+
+        with self.lock:
+            entry = self.requests.get(key)
+            if entry is None:
+                entry = self.requests[key] = [window_start, 0, 0]
+                if len(self.requests) > self.max_keys:
+                    self.requests.popitem(last=False)
+            else:
+                self.requests.move_to_end(key)
+
+            if entry[0] != window_start:
+                entry[2] = entry[1] if window_start - entry[0] == self.window else 0
+                entry[1] = 0
+                entry[0] = window_start
+
+            # Weight the previous window by how much of it still overlaps the sliding window
+            overlap = 1 - (now - window_start) / self.window
+            if entry[2] * overlap + entry[1] >= self.max_requests:
+                return False
+            entry[1] += 1
+            return True
 
-rate_limiter = RateLimit()
+# Per-user limits on /webhook by command class, keyed on the Telegram user (or chat)
+COMMAND_RATE_LIMITS = {
+    "heavy": RateLimit(max_requests=5, window=60),
+    "light": RateLimit(max_requests=30, window=60)
+}
+ipn_rate_limiter = RateLimit()
 
 def rate_limit(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not rate_limiter.is_allowed(request.remote_addr):
+        if not ipn_rate_limiter.is_allowed(request.remote_addr):
             logger.warning(f"Rate limit exceeded for IP: {request.remote_addr}")
             return "Rate limit exceeded", 429
         return f(*args, **kwargs)
@@ -89,86 +120,264 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 app = Flask(__name__)
 
+# ---- Command Queue ----
+# Slow commands run on a bounded worker pool so /webhook can ack immediately
+HEAVY_COMMANDS = {"/drop", "/memesnipe", "/joke", "/news", "/alert"}
+command_queue = CommandQueue(
+    workers=int(os.getenv('COMMAND_WORKERS', 4)),
+    max_queue=int(os.getenv('COMMAND_QUEUE_SIZE', 100))
+)
+
+# Identical /memesnipe or /news requests that arrive while one is running share its result
+single_flight = SingleFlight()
+
+# ---- Webhook Reply Mode ----
+# "inline" answers with the sendMessage call as the webhook response body when the
+# reply is ready within WEBHOOK_REPLY_DEADLINE seconds; "outbound" always posts it
+WEBHOOK_REPLY_MODE = os.getenv('WEBHOOK_REPLY_MODE', 'inline').lower()
+WEBHOOK_REPLY_DEADLINE = float(os.getenv('WEBHOOK_REPLY_DEADLINE', 0.5))
+# Show /memesnipe analysis as it is generated by editing a placeholder message
+STREAM_REPLIES = os.getenv('STREAM_REPLIES', 'true').lower() == 'true'
+reply_counts = {"inline": 0, "outbound": 0}
+reply_counts_lock = threading.Lock()
+
+def count_reply(mode):
+    with reply_counts_lock:
+        reply_counts[mode] += 1
+
+def inline_reply(chat_id, text):
+    count_reply("inline")
+    return {
+        "method": "sendMessage",
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "Markdown"
+    }, 200
+
 # ---- Alpha Drop: Main Stock Signal + Joke ----
+# Per-stage timeouts in seconds; the joke is optional, everything else is required
+DROP_STAGE_TIMEOUTS = {
+    "data": 30,
+    "chart": 30,
+    "analysis": 60,
+    "joke": 30
+}
+last_drop_timings = {}
+
+def fetch_drop_data(symbol):
+    info, hist = fetch_stock_data(symbol)
+    if not info or hist is None:
+        raise StageError(f"No stock data available for {symbol}")
+    return info, hist
+
+def render_drop_chart(symbol, data):
+    chart = generate_chart(symbol, data[1])
+    if not chart:
+        raise StageError("Failed to generate chart")
+    return chart
+
 def run_alpha_drop(chat_id, telegram_token, openai_api_key):
     try:
         symbol = "XFOR"
         logger.info(f"Starting alpha drop for {symbol}")
-        
-        info, hist = fetch_stock_data(symbol)
-        if info and hist is not None:
-            chart = generate_chart(symbol, hist)
-            if not chart:
-                logger.error("Failed to generate chart")
+
+        # data -> (chart, analysis) while the joke runs alongside
+        graph = StageGraph("alpha_drop")
+        graph.add("data", lambda: fetch_drop_data(symbol), timeout=DROP_STAGE_TIMEOUTS["data"])
+        graph.add("chart", lambda data: render_drop_chart(symbol, data), deps=["data"], timeout=DROP_STAGE_TIMEOUTS["chart"])
+        graph.add("analysis", lambda data: ask_chatgpt(symbol, data[0], data[1], openai_api_key), deps=["data"], timeout=DROP_STAGE_TIMEOUTS["analysis"])
+        graph.add("joke", lambda: nova_joke(openai_api_key), timeout=DROP_STAGE_TIMEOUTS["joke"])
+        results = graph.run()
+        last_drop_timings.clear()
+        last_drop_timings.update(graph.timings)
+
+        for stage in ("data", "chart", "analysis"):
+            if stage not in results:
+                logger.error(f"Alpha drop for {symbol} aborted: {stage} stage {graph.errors.get(stage)}")
                 return
-                
-            analysis = ask_chatgpt(symbol, info, hist, openai_api_key)
-            joke = nova_joke(openai_api_key)
-            final_message = f"{analysis}\n\n🦾 Nova's joke: {joke}"
-            
-            send_telegram_post(symbol, final_message, chart, chat_id, telegram_token)
-            logger.info(f"Successfully completed alpha drop for {symbol}")
-        else:
-            logger.error(f"No stock data available for {symbol}")
+
+        final_message = results["analysis"]
+        if "joke" in results:
+            final_message += f"\n\n🦾 Nova's joke: {results['joke']}"
+
+        file_id = send_telegram_post(symbol, final_message, results["chart"], chat_id, telegram_token)
+        logger.info(f"Successfully completed alpha drop for {symbol}")
+
+        # Fan the same photo out to paying members by reusing Telegram's file_id
+        if file_id and len(subscribers):
+            broadcaster.send("sendPhoto", {"photo": file_id, "caption": final_message, "parse_mode": "Markdown"}, subscribers.all())
     except Exception as e:
         logger.error(f"Error in run_alpha_drop: {str(e)}", exc_info=True)
 
+# ---- Broadcasts ----
+subscribers = Subscribers()
+broadcaster = Broadcaster(TELEGRAM_BOT_TOKEN)
+
+def start_member(chat_id, username, token=None):
+    """Handle /start: link a paid member's Telegram username or payment deep link to their chat."""
+    if subscribers.claim(chat_id, username, token):
+        return WELCOME_MESSAGE
+    if chat_id in subscribers:
+        return "🚀 You're already in. Next move hits soon."
+    return "🤖 Nova Stratos here. Try /memesnipe, /joke, /news or /alert."
+
+# ---- Price Alerts ----
+STOCK_ALERT_SECONDS = int(os.getenv('STOCK_ALERT_SECONDS', 300))
+alert_book = AlertBook.load()
+
+def notify_alert(chat_id, text):
+    send_telegram_message(chat_id, text, TELEGRAM_BOT_TOKEN)
+
+def fetch_stock_alert_values(symbol, metrics):
+    values = {}
+    if "rsi" in metrics:
+        info, hist = fetch_stock_data(symbol)
+        if hist is not None:
+            values["rsi"] = float(hist.rsi[-1])
+            values["price"] = info["regularMarketPrice"]
+    if "price" in metrics:
+        price = fetch_polygon_price(symbol)
+        if price is not None:
+            values["price"] = price
+    return values
+
+def create_alert(text, chat_id):
+    try:
+        symbol, metric, op, threshold = parse_alert_command(text)
+        snapshot = fetch_market_snapshot()
+        if snapshot and snapshot.position(symbol.lower()) is not None:
+            if metric != "price":
+                raise AlertError("Meme coin alerts only support price")
+            kind, symbol = "coin", symbol.lower()
+            current = float(snapshot.price[snapshot.position(symbol)])
+        else:
+            kind, symbol = "stock", symbol.upper()
+            current = fetch_stock_alert_values(symbol, {metric}).get(metric)
+            if current is None:
+                raise AlertError(f"Couldn't find a {metric} for {symbol}")
+
+        if (op == ">" and current >= threshold) or (op == "<" and current <= threshold):
+            return f"👀 {symbol.upper()} {metric} is already {current:g}, no alert needed."
+
+        alert = alert_book.add(chat_id, symbol, kind, metric, op, threshold)
+        # The fresh value may cross other subscribers' alerts on this symbol too
+        fire_alerts(alert_book.update(symbol, metric, current), current, notify_alert)
+        return f"🔔 Alert set: {format_alert(alert)} (now {current:g})"
+    except AlertError as e:
+        return f"⚠️ {str(e)}"
+
+def list_alerts(chat_id):
+    alerts = alert_book.for_chat(chat_id)
+    if not alerts:
+        return "No alerts set. Try /alert pepe > 0.000012 or /alert XFOR rsi<30"
+    return "🔔 Your alerts:\n" + "\n".join(format_alert(a) for a in alerts) + "\nRemove one with /unalert <id>"
+
+def check_coin_alerts(snapshot):
+    for symbol in alert_book.symbols("coin"):
+        i = snapshot.position(symbol)
+        if i is None:
+            continue
+        value = float(snapshot.price[i])
+        fire_alerts(alert_book.update(symbol, "price", value), value, notify_alert)
+
+def check_stock_alerts():
+    try:
+        for symbol, metrics in alert_book.symbols("stock").items():
+            for metric, value in fetch_stock_alert_values(symbol, metrics).items():
+                if metric in metrics:
+                    fire_alerts(alert_book.update(symbol, metric, value), value, notify_alert)
+    except Exception as e:
+        logger.error(f"Error checking stock alerts: {str(e)}", exc_info=True)
+
+price_listeners.append(check_coin_alerts)
+
 # ---- Telegram Photo Sender ----
-def send_telegram_post(symbol, analysis, chart_file, chat_id, telegram_token):
+def send_telegram_post(symbol, analysis, chart_png, chat_id, telegram_token):
     try:
-        url = f"https://api.telegram.org/bot{telegram_token}/sendPhoto"
-        
-        # Verify file exists and is readable
-        if not os.path.exists(chart_file):
-            logger.error(f"Chart file not found: {chart_file}")
-            return
-            
-        if not os.access(chart_file, os.R_OK):
-            logger.error(f"Chart file not readable: {chart_file}")
+        if not chart_png:
+            logger.error(f"No chart image for {symbol}")
             return
-            
-        with open(chart_file, 'rb') as f:
-            files = {'photo': f}
-            data = {
-                'chat_id': chat_id,
-                'caption': analysis,
-                'parse_mode': 'Markdown'
-            }
-            response = requests.post(url, files=files, data=data)
-            response.raise_for_status()
-            
-            logger.info(f"Successfully sent Telegram post for {symbol}")
-            
-            # Cleanup the chart file
-            try:
-                os.remove(chart_file)
-                logger.debug(f"Cleaned up chart file: {chart_file}")
-                
-                # Clean up old chart files
-                charts_dir = os.path.dirname(chart_file)
-                current_time = time.time()
-                for old_file in os.listdir(charts_dir):
-                    file_path = os.path.join(charts_dir, old_file)
-                    # Remove files older than 1 hour
-                    if os.path.isfile(file_path) and current_time - os.path.getmtime(file_path) > 3600:
-                        try:
-                            os.remove(file_path)
-                            logger.debug(f"Cleaned up old chart file: {file_path}")
-                        except Exception as e:
-                            logger.warning(f"Failed to cleanup old chart file {file_path}: {str(e)}")
-            except Exception as e:
-                logger.warning(f"Failed to cleanup chart file: {str(e)}")
-                
+
+        result = send_photo(telegram_token, chat_id, chart_png, f"{symbol}_chart.png", caption=analysis, parse_mode='Markdown')
+
+        logger.info(f"Successfully sent Telegram post for {symbol}")
+        return result["photo"][-1]["file_id"]
+
     except Exception as e:
         logger.error(f"Error in send_telegram_post: {str(e)}", exc_info=True)
 
+# ---- Telegram Text Sender ----
+def send_telegram_message(chat_id, text, bot_token):
+    payload = {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "Markdown"
+    }
+    send_with_retry(bot_token, "sendMessage", payload)
+    count_reply("outbound")
+
+# ---- Background Command Runner ----
+def run_heavy_command(command, chat_id, bot_token, openai_api_key, handoff=None, text=""):
+    start_time = time.time()
+    try:
+        if command == "/drop":
+            run_alpha_drop(chat_id, bot_token, openai_api_key)
+            reply = "🚀 Alpha drop initiated manually!"
+        elif command == "/memesnipe" and STREAM_REPLIES:
+            # The streamed message is the reply; release the webhook right away
+            if handoff is not None:
+                handoff.deliver(None)
+            stream = StreamingReply(bot_token, chat_id, "🔎 Nova is scanning the meme coin market…")
+            # Coalesced callers see only the final text on their own placeholder
+            reply = single_flight.do("memesnipe", nova_memesnipe, openai_api_key, on_text=stream.update)
+            stream.finish(reply)
+            count_reply("outbound")
+            return
+        elif command == "/memesnipe":
+            reply = single_flight.do("memesnipe", nova_memesnipe, openai_api_key)
+        elif command == "/joke":
+            reply = nova_joke(openai_api_key)
+        elif command == "/news":
+            reply = single_flight.do("news", get_finance_news)
+        elif command == "/alert":
+            reply = create_alert(text, chat_id)
+        else:
+            logger.warning(f"No background handler for '{command}'")
+            return
+    finally:
+        duration = time.time() - start_time
+        logger.info(f"Command '{command}' processed in {duration:.2f}s")
+
+    if handoff is None or not handoff.deliver(reply):
+        send_telegram_message(chat_id, reply, bot_token)
+
 # ---- Webhook Handler ----
+seen_updates = SeenUpdates()
+
 def handle_webhook(data, bot_token, allowed_chat_id, openai_api_key):
+    # Telegram redelivers updates it thinks timed out; handle each one once
+    update_id = data.get("update_id")
+    if update_id is None:
+        return handle_update(data, bot_token, allowed_chat_id, openai_api_key)
+    if not seen_updates.begin(update_id):
+        logger.info(f"Ignoring redelivered update {update_id}")
+        return "OK", 200
+
+    body, status = "Server error", 500
+    try:
+        body, status = handle_update(data, bot_token, allowed_chat_id, openai_api_key)
+        return body, status
+    finally:
+        # Only a handled update counts as seen; a failed one must be retried
+        seen_updates.finish(update_id, handled=status < 500)
+
+def handle_update(data, bot_token, allowed_chat_id, openai_api_key):
     try:
         message = data.get("message") or data.get("channel_post", {})
         text = message.get("text", "")
         chat_id = message.get("chat", {}).get("id")
         username = message.get("from", {}).get("username", "unknown")
+        user_key = message.get("from", {}).get("id") or chat_id
 
         logger.info(f"Received command '{text}' from @{username}")
 
@@ -185,43 +394,77 @@ def handle_webhook(data, bot_token, allowed_chat_id, openai_api_key):
         keywords = ["btc", "eth", "xfor", "doge", "pump", "ai"]
         keyword_found = next((kw for kw in keywords if kw in text.lower()), None)
 
-        # Command logic
-        start_time = time.time()
-        try:
-            if command == "/drop":
-                run_alpha_drop(chat_id, bot_token, openai_api_key)
-                reply = "🚀 Alpha drop initiated manually!"
-            elif command == "/memesnipe":
-                reply = nova_memesnipe(openai_api_key)
-            elif command == "/joke":
-                reply = nova_joke(openai_api_key)
-            elif command == "/news":
-                reply = get_finance_news()
-            elif command == "/status":
-                reply = "🤖 Nova Stratos is online and ready!"
-            elif keyword_found:
-                reply = f"👀 You mentioned *{keyword_found.upper()}* — want the latest update? Try /drop or /memesnipe."
-            else:
-                reply = "Unknown command. Try /drop, /memesnipe, /joke, or /news."
-        finally:
-            duration = time.time() - start_time
-            logger.info(f"Command '{command}' processed in {duration:.2f}s")
-
-        # Send reply
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": reply,
-            "parse_mode": "Markdown"
-        }
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
+        inline = WEBHOOK_REPLY_MODE == "inline"
+
+        command_class = "heavy" if command in HEAVY_COMMANDS else "light"
+        if not COMMAND_RATE_LIMITS[command_class].is_allowed(user_key):
+            # Acknowledge with 200 so Telegram doesn't redeliver the update
+            logger.warning(f"Rate limit exceeded for Telegram user {user_key} ({command_class} commands)")
+            slow_down = "🦾 Easy there, you're sending commands too fast. Try again in a minute."
+            if inline:
+                return inline_reply(chat_id, slow_down)
+            return "OK", 200
+
+        if command in HEAVY_COMMANDS:
+            handoff = ReplyHandoff() if inline else None
+            if not command_queue.submit(command, run_heavy_command, command, chat_id, bot_token, openai_api_key, handoff, text):
+                busy = "🦾 Nova is swamped right now, try again in a minute."
+                if inline:
+                    return inline_reply(chat_id, busy)
+                send_telegram_message(chat_id, busy, bot_token)
+                return "OK", 200
+            reply = handoff.wait(WEBHOOK_REPLY_DEADLINE) if handoff else None
+            if reply is not None:
+                return inline_reply(chat_id, reply)
+            return "OK", 200
+
+        if command == "/status":
+            reply = "🤖 Nova Stratos is online and ready!"
+        elif command == "/start" and message.get("chat", {}).get("type") == "private":
+            token = split_text[1] if len(split_text) > 1 else None
+            reply = start_member(chat_id, message.get("from", {}).get("username"), token)
+        elif command == "/alerts":
+            reply = list_alerts(chat_id)
+        elif command == "/unalert":
+            alert_id = split_text[1] if len(split_text) > 1 else ""
+            reply = "🔕 Alert removed." if alert_book.remove(alert_id, chat_id) else "No alert with that id. See /alerts"
+        elif keyword_found:
+            reply = f"👀 You mentioned *{keyword_found.upper()}* — want the latest update? Try /drop or /memesnipe."
+        else:
+            reply = "Unknown command. Try /drop, /memesnipe, /joke, or /news."
+
+        if inline:
+            return inline_reply(chat_id, reply)
+        send_telegram_message(chat_id, reply, bot_token)
         return "OK", 200
 
     except Exception as e:
         logger.error(f"Webhook handler error: {str(e)}", exc_info=True)
         return "Server error", 500
 
+# ---- Long Polling ----
+# 'webhook' (default) receives updates on /webhook; 'polling' pulls them with getUpdates
+TELEGRAM_MODE = os.getenv('TELEGRAM_MODE', 'webhook').lower()
+poller = None
+
+def handle_polled_update(update):
+    """Poller handler: False when handling failed, so the update is fetched again."""
+    body, status = handle_webhook(update, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, OPENAI_API_KEY)
+    if status >= 500:
+        return False
+    # Replies a webhook would return inline have to be sent as API calls here
+    if isinstance(body, dict) and "method" in body:
+        payload = dict(body)
+        send_with_retry(TELEGRAM_BOT_TOKEN, payload.pop("method"), payload)
+    return True
+
+def start_polling():
+    global poller
+    # getUpdates is refused while a webhook is registered
+    call_telegram(TELEGRAM_BOT_TOKEN, "deleteWebhook", {"drop_pending_updates": False})
+    poller = UpdatePoller(TELEGRAM_BOT_TOKEN, handle_polled_update)
+    poller.start()
+
 # ---- PayPal IPN Handler ----
 @app.route('/paypal-ipn', methods=['POST'])
 @rate_limit
@@ -229,30 +472,62 @@ def paypal_ipn():
     try:
         data = request.form.to_dict()
         logger.info("Received PayPal IPN")
-        
-        if not verify_ipn(data):
-            logger.warning("Invalid IPN received")
+
+        if not data:
+            logger.warning("Empty PayPal IPN")
             return "Invalid IPN", 400
-            
-        if data.get('payment_status') == "Completed" and data.get('mc_gross') == '97.00':
-            username = data.get('custom')
-            if username:
-                logger.info(f"Processing completed payment for @{username}")
-                send_welcome_dm(username, TELEGRAM_BOT_TOKEN)
-                logger.info(f"Welcome message sent to @{username}")
-            else:
-                logger.warning("Completed payment but no username provided")
-        else:
-            logger.info("Ignored non-matching IPN")
-            
+
+        # Only cheap checks here; verification with PayPal happens in the background.
+        # Anything that isn't a matching completed payment is acknowledged, since
+        # PayPal keeps re-sending IPNs that get a non-2xx response.
+        is_valid, error_msg = validate_ipn_data(data)
+        if not is_valid:
+            logger.info(f"Ignored non-matching IPN: {error_msg}")
+            return "OK", 200
+        if data['payment_status'] != "Completed":
+            logger.info(f"Ignored {data['payment_status']} IPN")
+            return "OK", 200
+
+        outbox_id = ipn_outbox.put(data)
+        logger.info(f"Queued IPN {outbox_id} (txn {data.get('txn_id')}) for verification")
         return "OK", 200
     except Exception as e:
         logger.error(f"PayPal IPN error: {str(e)}", exc_info=True)
         return "Server error", 500
 
+def verify_queued_ipn(data):
+    return process_ipn(data, TELEGRAM_BOT_TOKEN, on_paid=subscribers.add_pending,
+                       send_welcome=False)  # Welcome is sent when the member runs /start
+
+# ---- Background Workers ----
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_workers():
+    """
+    Start the IPN verifier and resume unfinished broadcasts, once per process.
+    Runs from __main__ and on the first request, so it also happens under a
+    WSGI server that imports app without running it.
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+
+    # Finish any broadcast interrupted by the last shutdown
+    broadcaster.resume_pending()
+
+    # Verify queued PayPal IPNs, including any left over from before a restart
+    ipn_outbox.start(verify_queued_ipn)
+
+@app.before_request
+def ensure_background_workers():
+    if not _background_started:
+        start_background_workers()
+
 # ---- Telegram Webhook ----
 @app.route('/webhook', methods=['POST'])
-@rate_limit
 def telegram_webhook():
     try:
         data = request.get_json()
@@ -264,18 +539,63 @@ def telegram_webhook():
         logger.error(f"Telegram webhook error: {str(e)}", exc_info=True)
         return "Server error", 500
 
+# ---- Metrics ----
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    with reply_counts_lock:
+        replies = dict(reply_counts)
+    return jsonify({
+        "command_queue": command_queue.stats(),
+        "webhook_replies": replies,
+        "single_flight": single_flight.stats(),
+        "coingecko_cache": cache_stats(),
+        "quotas": quota.quota_manager.stats(),
+        "last_drop_timings": dict(last_drop_timings),
+        "subscribers": subscribers.stats(),
+        "broadcasts": broadcaster.stats(),
+        "file_id_cache": file_id_cache.stats(),
+        "seen_updates": seen_updates.stats(),
+        "poller": poller.stats() if poller else None,
+        "ipn_outbox": ipn_outbox.stats(),
+        "llm_cache": response_cache.stats(),
+        "joke_pool": joke_pool.stats()
+    })
+
 # ---- Scheduler ----
+PRICE_POLL_SECONDS = int(os.getenv('PRICE_POLL_SECONDS', 60))
+
+def run_scheduled_drop():
+    # Scheduled drops outrank interactive commands for upstream quota
+    with quota.priority(quota.PRIORITY_SCHEDULED):
+        run_alpha_drop(TELEGRAM_CHAT_ID, TELEGRAM_BOT_TOKEN, OPENAI_API_KEY)
+
 def init_scheduler():
     try:
         scheduler = BackgroundScheduler()
         scheduler.add_job(
-            lambda: run_alpha_drop(TELEGRAM_CHAT_ID, TELEGRAM_BOT_TOKEN, OPENAI_API_KEY),
+            run_scheduled_drop,
             'interval',
             hours=4,
             misfire_grace_time=300,
             id='alpha_drop',
             next_run_time=datetime.now()  # Run immediately on startup
         )
+        scheduler.add_job(
+            poll_price_history,
+            'interval',
+            seconds=PRICE_POLL_SECONDS,
+            max_instances=1,
+            coalesce=True,
+            id='price_history'
+        )
+        scheduler.add_job(
+            check_stock_alerts,
+            'interval',
+            seconds=STOCK_ALERT_SECONDS,
+            max_instances=1,
+            coalesce=True,
+            id='stock_alerts'
+        )
         scheduler.start()
         logger.info("Scheduler started, dropping alpha every 4 hours")
     except Exception as e:
@@ -287,8 +607,16 @@ if __name__ == '__main__':
     # Create logs directory if it doesn't exist
     os.makedirs('logs', exist_ok=True)
     
+    start_background_workers()
+
+    # Have jokes ready before the first drop asks for one
+    joke_pool.warm(OPENAI_API_KEY)
+
     # Initialize scheduler
     init_scheduler()
+
+    if TELEGRAM_MODE == 'polling':
+        start_polling()
     
     # Start Flask app
     port = int(os.environ.get('PORT', 5000))
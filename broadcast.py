@@ -0,0 +1,622 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import quota
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/broadcast.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/{method}"
+BROADCAST_DIR = os.getenv('BROADCAST_DIR', os.path.join('data', 'broadcasts'))
+SUBSCRIBERS_PATH = os.getenv('SUBSCRIBERS_PATH', os.path.join('data', 'subscribers.json'))
+FILE_ID_CACHE_PATH = os.getenv('FILE_ID_CACHE_PATH', os.path.join('data', 'file_ids.json'))
+FILE_ID_CACHE_SIZE = 1000
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 10))
+PER_CHAT_INTERVAL = 1.0  # Telegram allows about one message per second to the same chat
+MAX_ATTEMPTS = 5
+REQUEST_TIMEOUT = 15
+MAX_FINISHED_KEPT = 10
+STREAM_EDIT_INTERVAL = 1.5  # seconds between edits of a streamed reply, under the ~1/s per-chat limit
+MESSAGE_LIMIT = 4096
+
+# Recipient states in the broadcast journal
+SENT = "sent"
+FAILED = "failed"
+
+# One keep-alive pool shared by every Telegram call, sized for the broadcast workers
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=BROADCAST_WORKERS + 4))
+
+class TelegramAPIError(Exception):
+    """A Telegram Bot API call that failed. `retry_after` is set on 429 responses."""
+    def __init__(self, status: int, description: str, retry_after: Optional[float] = None):
+        super().__init__(f"Telegram API error {status}: {description}")
+        self.status = status
+        self.description = description
+        self.retry_after = retry_after
+
+    @property
+    def permanent(self) -> bool:
+        """Errors retrying can't fix, like a user who blocked the bot or a chat that doesn't exist."""
+        return self.status in (400, 401, 403, 404)
+
+class ChatPacer:
+    """Per-chat send spacing, so no single chat gets more than one message per `interval`."""
+    def __init__(self, interval: float = PER_CHAT_INTERVAL, max_chats: int = 50000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def wait(self, chat_id) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if len(self._next_allowed) >= self.max_chats:
+                self._next_allowed = {c: t for c, t in self._next_allowed.items() if t > now}
+            slot = max(now, self._next_allowed.get(chat_id, 0.0))
+            self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+chat_pacer = ChatPacer()
+
+# Set when Telegram answers 429; every sender holds off until then
+_flood_lock = threading.Lock()
+_flood_until = 0.0
+
+def _wait_for_flood() -> None:
+    delay = _flood_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def _note_flood(retry_after: float) -> None:
+    global _flood_until
+    with _flood_lock:
+        _flood_until = max(_flood_until, time.monotonic() + retry_after)
+
+def call_telegram(bot_token: str, method: str, payload: Dict, files: Optional[Dict] = None, timeout: float = REQUEST_TIMEOUT) -> Dict:
+    """
+    Call a Bot API method under the global telegram quota and per-chat pacing.
+    Returns the `result` field; raises TelegramAPIError for API-level failures.
+    """
+    chat_id = payload.get("chat_id")
+    if chat_id is not None:
+        chat_pacer.wait(chat_id)
+    _wait_for_flood()
+    quota.acquire("telegram")
+
+    url = TELEGRAM_API_URL.format(token=bot_token, method=method)
+    if files:
+        response = session.post(url, data=payload, files=files, timeout=timeout)
+    else:
+        response = session.post(url, json=payload, timeout=timeout)
+
+    try:
+        body = response.json()
+    except ValueError:
+        response.raise_for_status()
+        raise TelegramAPIError(response.status_code, "non-JSON response")
+
+    if not body.get("ok"):
+        retry_after = body.get("parameters", {}).get("retry_after")
+        if retry_after:
+            _note_flood(retry_after)
+            logger.warning(f"Telegram flood limit hit on {method}, pausing sends for {retry_after}s")
+        raise TelegramAPIError(body.get("error_code", response.status_code), body.get("description", ""), retry_after)
+    return body["result"]
+
+def send_with_retry(bot_token: str, method: str, payload: Dict, files: Optional[Dict] = None, attempts: int = MAX_ATTEMPTS) -> Dict:
+    """call_telegram, retried on 429 (after `retry_after`) and on transient errors with backoff."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return call_telegram(bot_token, method, payload, files)
+        except TelegramAPIError as e:
+            if e.permanent or attempt == attempts:
+                raise
+            if not e.retry_after:
+                time.sleep(min(2 ** attempt, 30))
+        except requests.exceptions.RequestException:
+            if attempt == attempts:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+
+class FileIdCache:
+    """
+    Content hash -> Telegram file_id for files this bot has uploaded, least
+    recently used dropped first, persisted so a restart doesn't re-upload.
+    file_ids only work for the bot that uploaded them, so keys include the bot id.
+    """
+    def __init__(self, path: Optional[str] = FILE_ID_CACHE_PATH, max_size: int = FILE_ID_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            try:
+                with open(path) as f:
+                    self.entries.update(json.load(f))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Could not load file_id cache from {path}: {str(e)}")
+
+    @staticmethod
+    def key(bot_token: str, content: bytes) -> str:
+        return f"{bot_token.split(':')[0]}:{hashlib.sha256(content).hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            file_id = self.entries.get(key)
+            if file_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return file_id
+
+    def put(self, key: str, file_id: str) -> None:
+        with self.lock:
+            self.entries[key] = file_id
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self._save()
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with atomic_write(self.path) as f:
+                json.dump(self.entries, f)
+        except Exception as e:
+            logger.error(f"Failed to save file_id cache: {str(e)}")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+file_id_cache = FileIdCache()
+
+def send_photo(bot_token: str, chat_id, photo: bytes, filename: str, caption: Optional[str] = None, parse_mode: Optional[str] = None) -> Dict:
+    """
+    sendPhoto that uploads each distinct image once. Later sends of the same
+    bytes reference the cached file_id instead; if Telegram no longer accepts
+    that file_id the image is uploaded again.
+    """
+    payload = {"chat_id": chat_id}
+    if caption is not None:
+        payload["caption"] = caption
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+
+    key = FileIdCache.key(bot_token, photo)
+    file_id = file_id_cache.get(key)
+    if file_id:
+        try:
+            return send_with_retry(bot_token, "sendPhoto", dict(payload, photo=file_id))
+        except TelegramAPIError as e:
+            if e.status != 400 or "file" not in e.description.lower():
+                raise
+            logger.warning(f"Cached file_id for {filename} rejected ({e.description}), uploading again")
+            file_id_cache.discard(key)
+
+    result = send_with_retry(bot_token, "sendPhoto", payload, files={"photo": (filename, photo, "image/png")})
+    file_id_cache.put(key, result["photo"][-1]["file_id"])
+    return result
+
+class StreamingReply:
+    """
+    A reply that fills in while it is generated: a placeholder message is
+    sent first, then edited with the text so far at most once every
+    STREAM_EDIT_INTERVAL, and finally replaced with the finished text.
+    Partial text is sent without parse_mode, since half-written Markdown
+    often doesn't parse; the final edit uses Markdown.
+    """
+    def __init__(self, bot_token: str, chat_id, placeholder: str):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.message_id = None
+        self.shown = placeholder
+        self.last_edit = 0.0
+        self.edits = 0
+        try:
+            result = send_with_retry(bot_token, "sendMessage", {"chat_id": chat_id, "text": placeholder})
+            self.message_id = result["message_id"]
+        except Exception as e:
+            logger.error(f"Could not send placeholder to {chat_id}: {str(e)}")
+
+    def _edit(self, text: str, parse_mode: Optional[str] = None) -> None:
+        payload = {"chat_id": self.chat_id, "message_id": self.message_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        call_telegram(self.bot_token, "editMessageText", payload)
+        self.shown = text
+        self.last_edit = time.monotonic()
+        self.edits += 1
+
+    def update(self, text: str) -> None:
+        """Show the text generated so far, unless the last edit was too recent."""
+        if self.message_id is None or time.monotonic() - self.last_edit < STREAM_EDIT_INTERVAL:
+            return
+        text = text[:MESSAGE_LIMIT - 2] + " …" if len(text) > MESSAGE_LIMIT else text + " …"
+        if text == self.shown:
+            return
+        try:
+            self._edit(text)
+        except Exception as e:
+            # Progressive edits are best-effort; never let one abort the stream, finish() catches up
+            self.last_edit = time.monotonic()
+            logger.warning(f"Streaming edit to {self.chat_id} failed: {str(e)}")
+
+    def finish(self, text: str) -> None:
+        """Replace the placeholder with the final text (spilling past 4096 chars into new messages)."""
+        chunks = [text[i:i + MESSAGE_LIMIT] for i in range(0, len(text), MESSAGE_LIMIT)] or [text]
+        first, rest = chunks[0], chunks[1:]
+        if self.message_id is None:
+            rest = chunks
+        else:
+            try:
+                try:
+                    self._edit(first, parse_mode="Markdown")
+                except TelegramAPIError as e:
+                    if "not modified" in e.description:
+                        pass
+                    elif "parse" in e.description.lower():
+                        self._edit(first)
+                    else:
+                        raise
+            except Exception as e:
+                logger.error(f"Final edit to {self.chat_id} failed, sending instead: {str(e)}")
+                rest = chunks
+        for chunk in rest:
+            send_with_retry(self.bot_token, "sendMessage", {"chat_id": self.chat_id, "text": chunk})
+        logger.info(f"Streamed reply to {self.chat_id} with {self.edits} edits")
+
+class Subscribers:
+    """
+    Persisted list of chats that receive broadcasts.
+
+    The Bot API can only message a private user by numeric chat_id, which a
+    PayPal IPN doesn't carry. A completed payment therefore only records the
+    payer's Telegram username (and txn_id) as pending; the member becomes a
+    subscriber when they open the bot with /start, matched by their username
+    or by a `/start <txn_id>` deep-link payload.
+    """
+    def __init__(self, path: str = SUBSCRIBERS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.chats = []
+        self.pending = {}  # lowercased username -> txn_id
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            if isinstance(state, list):
+                # Old format: a list of "@username" chat ids that can't actually be messaged
+                state = {"chats": [c for c in state if isinstance(c, int)],
+                         "pending": {c[1:].lower(): None for c in state if isinstance(c, str) and c.startswith("@")}}
+            self.chats = state.get("chats", [])
+            self.pending = state.get("pending", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Could not load subscribers from {path}: {str(e)}")
+        self._members = set(self.chats)
+
+    def add_pending(self, username: str, txn_id: Optional[str] = None) -> None:
+        """Record a paid member who hasn't opened the bot yet."""
+        with self.lock:
+            self.pending[username.lstrip("@").lower()] = txn_id
+            self._save()
+        logger.info(f"Payment from @{username} awaiting /start")
+
+    def claim(self, chat_id: int, username: Optional[str] = None, token: Optional[str] = None) -> bool:
+        """
+        Subscribe `chat_id` if its username or deep-link token matches a pending
+        payment. Returns True when a new subscriber was added.
+        """
+        with self.lock:
+            key = username.lower() if username and username.lower() in self.pending else None
+            if key is None and token:
+                key = next((name for name, txn_id in self.pending.items() if txn_id and txn_id == token), None)
+            if key is None:
+                return False
+            del self.pending[key]
+            added = chat_id not in self._members
+            if added:
+                self._members.add(chat_id)
+                self.chats.append(chat_id)
+            self._save()
+        logger.info(f"Subscribed chat {chat_id} for paid member @{key} ({len(self.chats)} total)")
+        return added
+
+    def __contains__(self, chat_id) -> bool:
+        with self.lock:
+            return chat_id in self._members
+
+    def remove(self, chat_id) -> bool:
+        with self.lock:
+            if chat_id not in self._members:
+                return False
+            self._members.discard(chat_id)
+            self.chats.remove(chat_id)
+            self._save()
+        return True
+
+    def all(self) -> List:
+        with self.lock:
+            return list(self.chats)
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"subscribed": len(self.chats), "pending": len(self.pending)}
+
+    def _save(self) -> None:
+        with atomic_write(self.path) as f:
+            json.dump({"chats": self.chats, "pending": self.pending}, f)
+
+class Broadcast:
+    """
+    One message fanned out to many chats, journaled so it can resume after a crash.
+
+    The message and recipient list are written once to `<id>.json`; each
+    delivery outcome is appended as one line to `<id>.log`. On restart the
+    log is replayed and only recipients without an outcome are sent to.
+    """
+    def __init__(self, broadcast_id: str, method: str, payload: Dict, recipients: List, created_at: float, root: str):
+        self.id = broadcast_id
+        self.method = method
+        self.payload = payload
+        self.recipients = recipients
+        self.created_at = created_at
+        self.root = root
+        self.status = {}  # chat_id (as str) -> SENT / FAILED
+        self.lock = threading.Lock()
+        self.delivered = 0  # outcomes recorded by this process, for throughput
+        self.retries = 0
+        self.flood_waits = 0
+        self.started_at = None
+        self.finished_at = None
+        self._journal = None
+
+    @property
+    def header_path(self) -> str:
+        return os.path.join(self.root, f"{self.id}.json")
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.root, f"{self.id}.log")
+
+    @classmethod
+    def create(cls, method: str, payload: Dict, recipients: Iterable, root: str = BROADCAST_DIR) -> "Broadcast":
+        recipients = list(dict.fromkeys(recipients))
+        broadcast = cls(f"{int(time.time())}-{uuid.uuid4().hex[:6]}", method, payload, recipients, time.time(), root)
+        os.makedirs(root, exist_ok=True)
+        header = {
+            "id": broadcast.id,
+            "method": method,
+            "payload": payload,
+            "recipients": recipients,
+            "created_at": broadcast.created_at
+        }
+        with atomic_write(broadcast.header_path) as f:
+            json.dump(header, f)
+        return broadcast
+
+    @classmethod
+    def load(cls, header_path: str) -> "Broadcast":
+        with open(header_path) as f:
+            header = json.load(f)
+        broadcast = cls(header["id"], header["method"], header["payload"], header["recipients"],
+                        header["created_at"], os.path.dirname(header_path))
+        try:
+            with open(broadcast.journal_path) as f:
+                for line in f:
+                    chat_id, _, status = line.rstrip("\n").partition("\t")
+                    if status:  # a torn final line has no status and is simply resent
+                        broadcast.status[chat_id] = status
+        except FileNotFoundError:
+            pass
+        return broadcast
+
+    def pending(self) -> List:
+        with self.lock:
+            return [chat for chat in self.recipients if str(chat) not in self.status]
+
+    @property
+    def done(self) -> bool:
+        return len(self.status) >= len(self.recipients)
+
+    def record(self, chat_id, status: str) -> None:
+        with self.lock:
+            self.status[str(chat_id)] = status
+            self.delivered += 1
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a')
+            self._journal.write(f"{chat_id}\t{status}\n")
+            self._journal.flush()
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def stats(self) -> Dict:
+        with self.lock:
+            sent = sum(1 for s in self.status.values() if s == SENT)
+            failed = len(self.status) - sent
+            delivered = self.delivered
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "method": self.method,
+            "recipients": len(self.recipients),
+            "sent": sent,
+            "failed": failed,
+            "pending": len(self.recipients) - sent - failed,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "elapsed_seconds": round(elapsed, 1),
+            "messages_per_second": round(delivered / elapsed, 2) if elapsed > 0 else 0.0,
+            "finished": self.finished_at is not None
+        }
+
+class Broadcaster:
+    """
+    Runs broadcasts on a fixed pool of sender threads, at background quota
+    priority so interactive replies still go out first. Throughput is capped
+    by the shared telegram quota (about 30 messages a second).
+    """
+    def __init__(self, bot_token: str, workers: int = BROADCAST_WORKERS, root: str = BROADCAST_DIR):
+        self.bot_token = bot_token
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+        self.broadcasts = {}
+        self.lock = threading.Lock()
+        self._resume_lock = None
+
+    def send(self, method: str, payload: Dict, recipients: Iterable) -> Optional[str]:
+        """Start broadcasting `payload` (without chat_id) to every recipient. Returns the broadcast id."""
+        recipients = list(recipients)
+        if not recipients:
+            return None
+        broadcast = Broadcast.create(method, payload, recipients, self.root)
+        logger.info(f"Broadcast {broadcast.id}: {method} to {len(broadcast.recipients)} chats")
+        self._start(broadcast)
+        return broadcast.id
+
+    def resume_pending(self) -> int:
+        """
+        Pick up broadcasts a previous process didn't finish. Returns how many
+        were resumed. When several worker processes share `root`, only the one
+        holding the resume lock picks them up, so no chat gets a message twice.
+        """
+        resumed = 0
+        if not os.path.isdir(self.root):
+            return 0
+        if self._resume_lock is None:
+            lock_file = open(os.path.join(self.root, ".resume.lock"), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                logger.info("Another process is resuming broadcasts")
+                return 0
+            self._resume_lock = lock_file  # held for the life of the process
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                broadcast = Broadcast.load(os.path.join(self.root, name))
+            except Exception as e:
+                logger.error(f"Could not load broadcast {name}: {str(e)}")
+                continue
+            if broadcast.done:
+                continue
+            logger.info(f"Resuming broadcast {broadcast.id}: {len(broadcast.pending())} of {len(broadcast.recipients)} chats left")
+            self._start(broadcast)
+            resumed += 1
+        return resumed
+
+    def _start(self, broadcast: Broadcast) -> None:
+        with self.lock:
+            self.broadcasts[broadcast.id] = broadcast
+            # Keep finished broadcasts around only for the most recent metrics
+            finished = [b for b in self.broadcasts.values() if b.finished_at is not None]
+            for old in finished[:-MAX_FINISHED_KEPT]:
+                del self.broadcasts[old.id]
+        broadcast.started_at = time.time()
+        pending = broadcast.pending()
+        if not pending:
+            self._finish(broadcast)
+            return
+        remaining = [len(pending)]
+        remaining_lock = threading.Lock()
+
+        def deliver_one(chat_id):
+            try:
+                self._deliver(broadcast, chat_id)
+            finally:
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._finish(broadcast)
+
+        with quota.priority(quota.PRIORITY_BACKGROUND):
+            for chat_id in pending:
+                quota.submit(self.executor, deliver_one, chat_id)
+
+    def _deliver(self, broadcast: Broadcast, chat_id) -> None:
+        payload = dict(broadcast.payload, chat_id=chat_id)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                call_telegram(self.bot_token, broadcast.method, payload)
+                broadcast.record(chat_id, SENT)
+                return
+            except TelegramAPIError as e:
+                if e.permanent:
+                    logger.warning(f"Broadcast {broadcast.id}: giving up on {chat_id}: {e.description}")
+                    break
+                if e.retry_after:
+                    broadcast.count("flood_waits")
+                else:
+                    time.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                logger.warning(f"Broadcast {broadcast.id}: send to {chat_id} failed: {str(e)}")
+                time.sleep(min(2 ** attempt, 30))
+            broadcast.count("retries")
+        broadcast.record(chat_id, FAILED)
+
+    def _finish(self, broadcast: Broadcast) -> None:
+        broadcast.finished_at = time.time()
+        broadcast.close()
+        stats = broadcast.stats()
+        logger.info(f"Broadcast {broadcast.id} finished: {stats['sent']} sent, {stats['failed']} failed "
+                    f"in {stats['elapsed_seconds']}s ({stats['messages_per_second']} msg/s)")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            broadcasts = list(self.broadcasts.values())
+        return {b.id: b.stats() for b in broadcasts}
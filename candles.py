@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/candles.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+CANDLE_DIR = os.getenv('CANDLE_DIR', os.path.join('data', 'candles'))
+FIELDS = ('t', 'o', 'h', 'l', 'c', 'v')
+CANDLE_DTYPE = np.dtype([
+    ('t', np.int64),  # bar open time, epoch ms
+    ('o', np.float64),
+    ('h', np.float64),
+    ('l', np.float64),
+    ('c', np.float64),
+    ('v', np.float64)
+])
+
+class Candles:
+    """
+    OHLCV bars backed by a single structured NumPy array, oldest first.
+
+    Field accessors and slices are views into that array, never copies.
+    `index`, `close` and `volumes` keep the names the old History object used.
+    `rsi` is an optional per-bar array that stays aligned through slicing.
+    """
+    __slots__ = ('data', 'rsi')
+
+    def __init__(self, data: Optional[np.ndarray] = None, rsi: Optional[np.ndarray] = None):
+        self.data = np.empty(0, dtype=CANDLE_DTYPE) if data is None else data
+        self.rsi = rsi
+
+    @classmethod
+    def from_columns(cls, columns: np.ndarray) -> "Candles":
+        """Build from a (6, N) array with rows in FIELDS order, as kept by CandleStore."""
+        data = np.empty(columns.shape[1], dtype=CANDLE_DTYPE)
+        for i, field in enumerate(FIELDS):
+            data[field] = columns[i]
+        return cls(data)
+
+    @classmethod
+    def from_bars(cls, bars: List[Dict]) -> "Candles":
+        """Build from Polygon-style bar dicts."""
+        data = np.empty(len(bars), dtype=CANDLE_DTYPE)
+        for field in FIELDS:
+            data[field] = [bar[field] for bar in bars]
+        return cls(data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Candles(self.data[key], None if self.rsi is None else self.rsi[key])
+        return self.data[key]
+
+    def __repr__(self) -> str:
+        return f"Candles({len(self)} bars)"
+
+    @property
+    def t(self) -> np.ndarray:
+        return self.data['t']
+
+    @property
+    def o(self) -> np.ndarray:
+        return self.data['o']
+
+    @property
+    def h(self) -> np.ndarray:
+        return self.data['h']
+
+    @property
+    def l(self) -> np.ndarray:
+        return self.data['l']
+
+    @property
+    def c(self) -> np.ndarray:
+        return self.data['c']
+
+    @property
+    def v(self) -> np.ndarray:
+        return self.data['v']
+
+    index = t
+    close = c
+    volumes = v
+
+class CandleStore:
+    """
+    On-disk OHLCV store keyed by symbol and timeframe.
+
+    Each series is one .npy file holding a (6, N) float64 array, one row per
+    field in FIELDS order, so every field is a contiguous column that can be
+    memory-mapped. Timestamps are epoch milliseconds, exact in float64.
+    Writes go to a temp file and are swapped in with os.replace, so readers in
+    other processes always see a complete series.
+    """
+    def __init__(self, root: str = CANDLE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, f"{symbol.upper()}_{timeframe}.npy")
+
+    def load(self, symbol: str, timeframe: str) -> Optional[np.ndarray]:
+        """Memory-map the stored (6, N) series, or None if nothing is stored yet."""
+        path = self.path(symbol, timeframe)
+        try:
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.error(f"Unreadable candle file {path}, ignoring it: {str(e)}")
+            return None
+
+    def last_timestamp(self, symbol: str, timeframe: str) -> Optional[int]:
+        series = self.load(symbol, timeframe)
+        if series is None or series.shape[1] == 0:
+            return None
+        return int(series[0, -1])
+
+    def merge(self, symbol: str, timeframe: str, bars: List[Dict]) -> int:
+        """
+        Add Polygon-style bars (dicts with t/o/h/l/c/v) to the series. Stored bars
+        at or after the first new timestamp are replaced, so a bar that was still
+        forming when it was last fetched gets overwritten. Returns the new length.
+        """
+        if not bars:
+            series = self.load(symbol, timeframe)
+            return 0 if series is None else series.shape[1]
+
+        new = np.array([[bar[field] for bar in bars] for field in FIELDS], dtype=np.float64)
+        new = new[:, np.argsort(new[0], kind='stable')]
+
+        with self._lock:
+            existing = self.load(symbol, timeframe)
+            if existing is not None:
+                keep = np.searchsorted(existing[0], new[0, 0], side='left')
+                new = np.concatenate([existing[:, :keep], new], axis=1)
+
+            path = self.path(symbol, timeframe)
+            with atomic_write(path, 'wb') as f:
+                np.save(f, new)
+
+        logger.info(f"Stored {len(bars)} bars for {symbol.upper()} {timeframe} ({new.shape[1]} total)")
+        return new.shape[1]
+
+    def candles(self, symbol: str, timeframe: str, limit: Optional[int] = None) -> Candles:
+        """The last `limit` stored bars (all of them if None) as Candles."""
+        series = self.load(symbol, timeframe)
+        if series is None:
+            return Candles()
+        return Candles.from_columns(series if limit is None else series[:, -limit:])
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/dedupe.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+UPDATE_LOG_PATH = os.getenv('UPDATE_LOG_PATH', os.path.join('data', 'seen_updates.log'))
+UPDATE_WINDOW_SIZE = 10000
+UPDATE_WINDOW_SECONDS = 24 * 60 * 60  # Telegram stops redelivering an update after a day
+
+class SeenUpdates:
+    """
+    Sliding window of recently handled Telegram update_ids.
+
+    Ids are kept in arrival order in an OrderedDict, so membership is a dict
+    lookup and expiry only ever pops from the old end. The window holds at
+    most `max_size` ids no older than `max_age` seconds. Each new id is
+    appended to a log file; the log is rewritten with just the live window
+    once it grows to twice `max_size` lines.
+
+    An update is only recorded once it has been handled: `begin` reserves the
+    id in memory so a concurrent redelivery is turned away, and `finish`
+    either records it or, if handling failed, releases it so Telegram's
+    retry is processed.
+    """
+    def __init__(self, path: Optional[str] = UPDATE_LOG_PATH, max_size: int = UPDATE_WINDOW_SIZE, max_age: float = UPDATE_WINDOW_SECONDS):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.seen = OrderedDict()  # update_id -> time first seen
+        self.lock = threading.Lock()
+        self.in_progress = set()
+        self.duplicates = 0
+        self._log = None
+        self._log_lines = 0
+        self._load()
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.max_age
+        while self.seen:
+            update_id, seen_at = next(iter(self.seen.items()))
+            if len(self.seen) <= self.max_size and seen_at >= cutoff:
+                break
+            self.seen.popitem(last=False)
+
+    def begin(self, update_id: int) -> bool:
+        """Reserve `update_id` for handling. False if it was already handled or is being handled."""
+        with self.lock:
+            if update_id in self.seen or update_id in self.in_progress:
+                self.duplicates += 1
+                return False
+            self.in_progress.add(update_id)
+            return True
+
+    def finish(self, update_id: int, handled: bool = True) -> None:
+        """Record a handled update, or release a failed one so a redelivery can retry it."""
+        now = time.time()
+        with self.lock:
+            self.in_progress.discard(update_id)
+            if not handled:
+                return
+            self.seen[update_id] = now
+            self._expire(now)
+            self._append(update_id, now)
+
+    def __contains__(self, update_id: int) -> bool:
+        with self.lock:
+            return update_id in self.seen
+
+    def _append(self, update_id: int, seen_at: float) -> None:
+        if not self.path:
+            return
+        try:
+            if self._log_lines >= 2 * self.max_size:
+                self._compact()
+            if self._log is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._log = open(self.path, 'a')
+            self._log.write(f"{update_id}\t{seen_at:.3f}\n")
+            self._log.flush()
+            self._log_lines += 1
+        except Exception as e:
+            logger.error(f"Failed to record update {update_id}: {str(e)}")
+
+    def _compact(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        with atomic_write(self.path) as f:
+            for update_id, seen_at in self.seen.items():
+                f.write(f"{update_id}\t{seen_at:.3f}\n")
+        self._log_lines = len(self.seen)
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    update_id, _, seen_at = line.rstrip("\n").partition("\t")
+                    if not seen_at:  # torn final line
+                        continue
+                    self.seen[int(update_id)] = float(seen_at)
+                    self._log_lines += 1
+            self._expire(time.time())
+            logger.info(f"Loaded {len(self.seen)} recent update ids")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Could not load seen updates from {self.path}: {str(e)}")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"tracked": len(self.seen), "in_progress": len(self.in_progress), "duplicates": self.duplicates}
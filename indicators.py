@@ -0,0 +1,287 @@
+"""
+Technical indicators for many symbols at once.
+
+The batch functions take a 2-D array with one row per symbol, oldest bar
+first, and compute the indicator for all rows at once; stock.py computes its
+RSI, moving averages and bands through them. The streaming classes keep
+per-symbol state and fold in one new bar in constant time, matching the batch
+results once there are enough bars for each window; nothing feeds them live
+candles yet. Windows that don't fit
+yet come back as NaN (batch) or None (streaming).
+"""
+import math
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+RSI_PERIOD = 14
+BOLLINGER_PERIOD = 20
+VOLUME_PERIOD = 20
+
+# Longest run of bars folded into one closed-form block of the RSI filter.
+# Keeps decay**-block well inside float64 range for any period.
+MAX_FILTER_BLOCK = 256
+
+def as_matrix(values) -> np.ndarray:
+    """Coerce a 1-D series or 2-D matrix to a float64 (symbols x bars) matrix."""
+    matrix = np.asarray(values, dtype=np.float64)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    if matrix.ndim != 2:
+        raise ValueError(f"Expected a (symbols x bars) matrix, got shape {matrix.shape}")
+    return matrix
+
+def rolling_mean(values, window: int) -> np.ndarray:
+    """Simple moving average per row via cumulative sums. Shape (S, N - window + 1)."""
+    x = as_matrix(values)
+    if x.shape[1] < window:
+        return np.empty((x.shape[0], 0))
+    csum = np.zeros((x.shape[0], x.shape[1] + 1))
+    np.cumsum(x, axis=1, out=csum[:, 1:])
+    return (csum[:, window:] - csum[:, :-window]) / window
+
+def rolling_std(values, window: int) -> np.ndarray:
+    """Population rolling standard deviation per row. Shape (S, N - window + 1)."""
+    x = as_matrix(values)
+    if x.shape[1] < window:
+        return np.empty((x.shape[0], 0))
+    # Center each row first so the sum-of-squares trick doesn't cancel catastrophically
+    centered = x - x.mean(axis=1, keepdims=True)
+    mean = rolling_mean(centered, window)
+    mean_sq = rolling_mean(centered * centered, window)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0))
+
+def wilder_smooth(seed: np.ndarray, values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Run Wilder's smoothing s[k] = (s[k-1] * (period - 1) + v[k]) / period across
+    every row at once, starting from `seed`. Returns s[1..K] with shape (S, K).
+
+    The recursion is a first-order linear filter, so each block of bars has the
+    closed form s[k] = a**k * (s[0] + sum_j a**-j * v[j] / period) with
+    a = (period - 1) / period; blocks are chained on their last value.
+    """
+    seed = np.asarray(seed, dtype=np.float64)
+    values = as_matrix(values)
+    out = np.empty_like(values)
+    if period <= 1:
+        out[:] = values
+        return out
+
+    decay = (period - 1) / period
+    block = max(1, min(MAX_FILTER_BLOCK, int(500 / -np.log(decay))))
+    state = seed
+    for start in range(0, values.shape[1], block):
+        chunk = values[:, start:start + block]
+        k = np.arange(1, chunk.shape[1] + 1)
+        acc = np.cumsum(chunk * decay ** -k, axis=1) / period
+        out[:, start:start + chunk.shape[1]] = decay ** k * (state[:, np.newaxis] + acc)
+        state = out[:, start + chunk.shape[1] - 1]
+    return out
+
+def _rsi_from(up: np.ndarray, down: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = up / down
+        rsi = 100. - 100. / (1. + rs)
+    return np.where(down == 0, 100., rsi)
+
+def batch_rsi(closes, period: int = RSI_PERIOD) -> np.ndarray:
+    """
+    Wilder RSI for every row, laid out per bar like the chart expects: the
+    first `period` bars hold the seed RSI. Rows too short for a seed are all zeros.
+    """
+    x = as_matrix(closes)
+    rsi = np.zeros_like(x)
+    deltas = np.diff(x, axis=1)
+    if deltas.shape[1] < period:
+        return rsi
+
+    gains = np.where(deltas > 0, deltas, 0.)
+    losses = np.where(deltas > 0, 0., -deltas)
+
+    up = gains[:, :period].sum(axis=1) / period
+    down = losses[:, :period].sum(axis=1) / period
+    rsi[:, :period] = _rsi_from(up, down)[:, np.newaxis]
+
+    # Bar i takes deltas[i - 1], starting from bar `period`, so the last seed delta is smoothed in again
+    up_series = wilder_smooth(up, gains[:, period - 1:], period)
+    down_series = wilder_smooth(down, losses[:, period - 1:], period)
+    rsi[:, period:] = _rsi_from(up_series, down_series)
+    return rsi
+
+def _last(series: np.ndarray) -> np.ndarray:
+    if series.shape[1] == 0:
+        return np.full(series.shape[0], np.nan)
+    return series[:, -1]
+
+def batch_indicators(closes, volumes) -> Dict[str, np.ndarray]:
+    """
+    Latest-bar indicators for every row, keyed like `calculate_technical_indicators`
+    plus the full `rsi` matrix. Each scalar indicator is an (S,) array.
+    """
+    closes = as_matrix(closes)
+    volumes = as_matrix(volumes)
+    if closes.shape != volumes.shape:
+        raise ValueError(f"closes {closes.shape} and volumes {volumes.shape} must have the same shape")
+
+    ma20 = _last(rolling_mean(closes, 20))
+    ma50 = _last(rolling_mean(closes, 50))
+
+    std = np.std(closes[:, -BOLLINGER_PERIOD:], axis=1)
+    current_price = closes[:, -1]
+    avg_volume = np.mean(volumes[:, -VOLUME_PERIOD:], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'ma20': ma20,
+            'ma50': ma50,
+            'upper_band': ma20 + std * 2,
+            'lower_band': ma20 - std * 2,
+            'price_vs_ma20': (current_price / ma20 - 1) * 100,
+            'price_vs_ma50': (current_price / ma50 - 1) * 100,
+            'volume_ratio': volumes[:, -1] / avg_volume,
+            'rsi': batch_rsi(closes)
+        }
+
+# ---- Streaming Indicators ----
+class StreamingSMA:
+    """Simple moving average over the last `window` values, O(1) per update."""
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self._since_resum = 0
+
+    def update(self, value: float) -> Optional[float]:
+        if len(self.values) == self.window:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        # Re-add the window now and then so float drift can't accumulate
+        self._since_resum += 1
+        if self._since_resum >= self.window:
+            self.total = math.fsum(self.values)
+            self._since_resum = 0
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if len(self.values) < self.window:
+            return None
+        return self.total / self.window
+
+class StreamingStd(StreamingSMA):
+    """Population standard deviation over the last `window` values, O(1) per update."""
+    def __init__(self, window: int):
+        super().__init__(window)
+        self.total_sq = 0.0
+
+    def update(self, value: float) -> Optional[float]:
+        if len(self.values) == self.window:
+            self.total_sq -= self.values[0] ** 2
+        self.total_sq += value ** 2
+        super().update(value)
+        if self._since_resum == 0:
+            self.total_sq = math.fsum(v * v for v in self.values)
+        return self.value
+
+    @property
+    def mean(self) -> Optional[float]:
+        return super().value
+
+    @property
+    def value(self) -> Optional[float]:
+        mean = self.mean
+        if mean is None:
+            return None
+        return math.sqrt(max(self.total_sq / self.window - mean * mean, 0.0))
+
+class StreamingRSI:
+    """
+    Wilder RSI fed one close at a time, seeded exactly like `batch_rsi`: the first
+    `period` deltas form the seed averages, and the last seed delta is also the
+    first smoothed update.
+    """
+    def __init__(self, period: int = RSI_PERIOD):
+        self.period = period
+        self.prev_close = None
+        self.count = 0
+        self.up = 0.0
+        self.down = 0.0
+
+    def update(self, close: float) -> Optional[float]:
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+        delta = close - self.prev_close
+        self.prev_close = close
+        upval, downval = (delta, 0.0) if delta > 0 else (0.0, -delta)
+        self.count += 1
+
+        if self.count <= self.period:
+            self.up += upval
+            self.down += downval
+            if self.count < self.period:
+                return None
+            self.up /= self.period
+            self.down /= self.period
+
+        self.up = (self.up * (self.period - 1) + upval) / self.period
+        self.down = (self.down * (self.period - 1) + downval) / self.period
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if self.count < self.period:
+            return None
+        if self.down == 0:
+            return 100.0
+        return 100. - 100. / (1. + self.up / self.down)
+
+class StreamingIndicators:
+    """
+    Live indicator set for one symbol, producing the same keys as
+    `calculate_technical_indicators` plus `rsi` after every closed candle.
+    """
+    def __init__(self, rsi_period: int = RSI_PERIOD):
+        self.rsi = StreamingRSI(rsi_period)
+        self.ma20 = StreamingSMA(20)
+        self.ma50 = StreamingSMA(50)
+        self.std20 = StreamingStd(BOLLINGER_PERIOD)
+        self.vol_sma = StreamingSMA(VOLUME_PERIOD)
+        self.close = None
+        self.volume = None
+
+    @classmethod
+    def seed(cls, closes: Iterable[float], volumes: Iterable[float], rsi_period: int = RSI_PERIOD) -> "StreamingIndicators":
+        """Build live state from history; later candles go through `update`."""
+        live = cls(rsi_period)
+        for close, volume in zip(closes, volumes):
+            live.update(close, volume)
+        return live
+
+    def update(self, close: float, volume: float) -> Dict:
+        self.close = float(close)
+        self.volume = float(volume)
+        self.rsi.update(self.close)
+        self.ma20.update(self.close)
+        self.ma50.update(self.close)
+        self.std20.update(self.close)
+        self.vol_sma.update(self.volume)
+        return self.values()
+
+    def values(self) -> Dict:
+        ma20 = self.ma20.value
+        ma50 = self.ma50.value
+        std = self.std20.value
+        avg_volume = self.vol_sma.value
+        return {
+            'ma20': ma20,
+            'ma50': ma50,
+            'upper_band': ma20 + std * 2 if ma20 is not None else None,
+            'lower_band': ma20 - std * 2 if ma20 is not None else None,
+            'price_vs_ma20': (self.close / ma20 - 1) * 100 if ma20 else 0,
+            'price_vs_ma50': (self.close / ma50 - 1) * 100 if ma50 else 0,
+            'volume_ratio': self.volume / avg_volume if avg_volume else None,
+            'rsi': self.rsi.value
+        }
@@ -1,7 +1,34 @@
 import openai
 import random
 import os
+import re
+import hashlib
+import logging
+import threading
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from llm import chat_completion
+import quota
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/jokes.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOPIC = "trading, crypto, meme coins, or financial markets"
+JOKES_PER_CALL = 5     # completions requested per API call (n)
+POOL_LOW_WATERMARK = 2  # refill a pool once it drops below this
+POOL_HIGH_WATERMARK = 8 # and top it up to this
+MAX_REFILL_CALLS = 3   # API calls one refill may make before giving up
+RECENT_JOKES = 500     # served jokes remembered to avoid repeats
 
 COMEDIANS = [
     "George Carlin",
@@ -17,37 +44,173 @@ COMEDIANS = [
     "Ali Wong"
 ]
 
-def nova_joke(openai_api_key):
-    openai.api_key = openai_api_key
-    prompt = (
-        "You are Nova Stratos, an AI quant analyst with a dry, clever sense of trading humor. "
-        "Generate a witty one-liner or joke related to trading, crypto, meme coins, or the wild world of financial markets. "
-        "Make sure it’s fresh and never just a cliché."
-    )
-    response = openai.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    result = response.choices[0].message.content if response.choices else "No joke this time!"
-    return result
+NOVA_PROMPT = (
+    "You are Nova Stratos, an AI quant analyst with a dry, clever sense of trading humor. "
+    "Generate a witty one-liner or joke related to trading, crypto, meme coins, or the wild world of financial markets. "
+    "Make sure it’s fresh and never just a cliché."
+)
 
-  
-    
-def random_comedian_joke(openai_api_key, topic="trading, crypto, meme coins, or financial markets"):
-    openai.api_key = openai_api_key
-    comedian = random.choice(COMEDIANS)
-    prompt = (
+def comedian_prompt(comedian, topic=DEFAULT_TOPIC):
+    return (
         f"Act as {comedian}, the legendary stand-up comedian. "
         f"Make a brand new, sharp, clever joke about {topic} as if you're performing live. "
         f"Channel the exact comedic style, voice, and attitude of {comedian}. "
         f"Don't recycle classic bits; make it original and relevant to modern trading, markets, or crypto culture. "
         f"Deliver it as a one-liner or a short bit, and sign off with '- {comedian}'."
     )
-    response = openai.chat.completions.create(
+
+def generate_jokes(prompt, n=1):
+    """One API call returning up to `n` jokes for `prompt`."""
+    response = chat_completion(
         model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": prompt}],
+        n=n
     )
-    return response.choices[0].message.content
+    return [choice.message.content for choice in response.choices if choice.message.content]
+
+class JokePool:
+    """
+    Pre-generated jokes, one sub-pool for Nova and one per comedian
+    (created the first time that comedian is asked for).
+
+    Taking a joke is instant while its pool has stock; a pool that drops
+    below the low watermark is topped up to the high watermark in the
+    background, JOKES_PER_CALL completions per API call. Hashes of recently
+    served jokes are kept so the same joke isn't served twice.
+    """
+    def __init__(self):
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=RECENT_JOKES)
+        self.recent_hashes = set()
+        self.refilling = set()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="jokes")
+        self._stats = {"served_from_pool": 0, "served_direct": 0, "generated": 0, "duplicates": 0, "api_calls": 0}
+
+    @staticmethod
+    def _digest(joke):
+        normalized = re.sub(r"[^a-z0-9]+", " ", joke.lower()).strip()
+        return hashlib.sha1(normalized.encode()).hexdigest()
+
+    def _remember(self, joke):
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_hashes.discard(self.recent[0])
+        digest = self._digest(joke)
+        self.recent.append(digest)
+        self.recent_hashes.add(digest)
+
+    def _stock(self, key, jokes):
+        """
+        Add new jokes to a pool, dropping repeats of served or already pooled
+        ones. Returns how many were added. Lock held.
+        """
+        pool = self.pools.setdefault(key, deque())
+        pooled = {self._digest(j) for j in pool}
+        added = 0
+        for joke in jokes:
+            digest = self._digest(joke)
+            if digest in self.recent_hashes or digest in pooled:
+                self._stats["duplicates"] += 1
+                continue
+            pooled.add(digest)
+            pool.append(joke)
+            added += 1
+            self._stats["generated"] += 1
+        return added
+
+    def _pop_fresh(self, key):
+        """Next pooled joke that hasn't been served recently, or None. Lock held."""
+        pool = self.pools.get(key)
+        while pool:
+            joke = pool.popleft()
+            if self._digest(joke) not in self.recent_hashes:
+                return joke
+            self._stats["duplicates"] += 1
+        return None
+
+    def _refill(self, key, prompt):
+        try:
+            with quota.priority(quota.PRIORITY_BACKGROUND):
+                for _ in range(MAX_REFILL_CALLS):
+                    with self.lock:
+                        missing = POOL_HIGH_WATERMARK - len(self.pools.get(key, ()))
+                    if missing <= 0:
+                        break
+                    jokes = generate_jokes(prompt, min(missing, JOKES_PER_CALL))
+                    with self.lock:
+                        self._stats["api_calls"] += 1
+                        added = self._stock(key, jokes)
+                    if not added:
+                        # The model is only repeating itself; try again on the next low watermark
+                        logger.warning(f"Joke pool '{key}' refill got no new jokes, stopping")
+                        break
+        except Exception as e:
+            logger.error(f"Refilling joke pool '{key}' failed: {str(e)}")
+        finally:
+            with self.lock:
+                self.refilling.discard(key)
+
+    def _maybe_refill(self, key, prompt):
+        """Schedule a background refill if the pool is low and none is running. Lock held."""
+        if len(self.pools.get(key, ())) < POOL_LOW_WATERMARK and key not in self.refilling:
+            self.refilling.add(key)
+            self.executor.submit(self._refill, key, prompt)
+
+    def take(self, key, prompt):
+        """A joke from pool `key`, generated on the spot if the pool is empty."""
+        with self.lock:
+            joke = self._pop_fresh(key)
+            if joke is not None:
+                self._stats["served_from_pool"] += 1
+                self._remember(joke)
+                self._maybe_refill(key, prompt)
+                return joke
+
+        # Pool is empty (cold start): pay for one batch now and keep the rest,
+        # instead of also scheduling a background refill for the same pool
+        jokes = generate_jokes(prompt, JOKES_PER_CALL)
+        with self.lock:
+            self._stats["api_calls"] += 1
+            self._stats["served_direct"] += 1
+            if not jokes:
+                return None
+            fresh = [j for j in jokes if self._digest(j) not in self.recent_hashes]
+            joke = (fresh or jokes)[0]
+            self._remember(joke)
+            self._stock(key, fresh[1:])
+            self._maybe_refill(key, prompt)
+        return joke
+
+    def warm(self, openai_api_key):
+        """Fill Nova's pool in the background. Comedian pools fill on first use."""
+        openai.api_key = openai_api_key
+        with self.lock:
+            self._maybe_refill("nova", NOVA_PROMPT)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+            stats["pooled"] = {key: len(pool) for key, pool in self.pools.items()}
+            return stats
+
+joke_pool = JokePool()
+
+def nova_joke(openai_api_key):
+    openai.api_key = openai_api_key
+    result = joke_pool.take("nova", NOVA_PROMPT)
+    return result or "No joke this time!"
+
+def random_comedian_joke(openai_api_key, topic=DEFAULT_TOPIC):
+    openai.api_key = openai_api_key
+    comedian = random.choice(COMEDIANS)
+    if topic != DEFAULT_TOPIC:
+        # Custom topics aren't pooled; fall back to a pooled joke if none came back
+        jokes = generate_jokes(comedian_prompt(comedian, topic))
+        if jokes:
+            return jokes[0]
+        logger.warning(f"No joke generated for topic {topic!r}, serving a pooled one")
+    result = joke_pool.take(comedian, comedian_prompt(comedian))
+    return result or "No joke this time!"
 
 
 # Example CLI test
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional
+
+import openai
+
+import quota
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/llm.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS = 500  # Budget assumed for completions that don't set max_tokens
+LLM_CACHE_SIZE = 256
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH')  # Set to persist cached responses across restarts
+
+def estimate_tokens(messages, max_tokens=None, n=1) -> int:
+    """Rough upper bound on a chat call's tokens (~4 characters per prompt token) for TPM budgeting."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + (max_tokens or DEFAULT_MAX_TOKENS) * n
+
+def chat_completion(**kwargs):
+    """openai.chat.completions.create behind the shared OpenAI RPM/TPM quota."""
+    estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"), kwargs.get("n", 1))
+    quota.acquire("openai", tokens=estimated)
+    response = openai.chat.completions.create(**kwargs)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None) is not None:
+        quota.quota_manager["openai"].settle(estimated, usage.total_tokens)
+    return response
+
+def stream_completion(**kwargs) -> Iterator[str]:
+    """
+    Streamed chat completion under the same quota as chat_completion,
+    yielding the first choice's text as it arrives, one delta at a time.
+    """
+    estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"), kwargs.get("n", 1))
+    quota.acquire("openai", tokens=estimated)
+    stream = openai.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+
+    for chunk in stream:
+        usage = getattr(chunk, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None) is not None:
+            quota.quota_manager["openai"].settle(estimated, usage.total_tokens)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+class ResponseCache:
+    """
+    LRU cache of completion texts with a per-entry TTL, optionally persisted
+    to a JSON file so restarts don't throw paid-for answers away.
+    """
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, path: Optional[str] = LLM_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()  # key -> [expires_at, text]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            try:
+                with open(path) as f:
+                    now = time.time()
+                    self.entries.update((k, v) for k, v in json.load(f) if v[0] > now)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Could not load LLM cache from {path}: {str(e)}")
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, text: str, ttl: float) -> None:
+        with self.lock:
+            self.entries[key] = [time.time() + ttl, text]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with atomic_write(self.path) as f:
+                json.dump(list(self.entries.items()), f)
+        except Exception as e:
+            logger.error(f"Failed to save LLM cache: {str(e)}")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+response_cache = ResponseCache()
+_in_flight = {}  # key -> Event set when the leading call for that key finishes
+_in_flight_lock = threading.Lock()
+
+def cache_key(model: str, messages, **params) -> str:
+    """
+    Digest of the model, the prompts and the sampling parameters. Prompts
+    carry their numbers already formatted to display precision, so inputs
+    that only differ past what the prompt shows map to the same key.
+    """
+    normalized = [
+        {"role": m.get("role"), "content": re.sub(r"\s+", " ", m.get("content") or "").strip()}
+        for m in messages
+    ]
+    blob = json.dumps({"model": model, "messages": normalized, "params": params}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def cached_completion(ttl: float, on_text: Optional[Callable[[str], None]] = None, **kwargs) -> Optional[str]:
+    """
+    Text of the first choice of chat_completion(**kwargs), served from the
+    response cache for `ttl` seconds. Identical requests already in flight
+    share one API call. Returns None if the model sent back no choices.
+
+    With `on_text`, a cache miss is streamed and `on_text` is called with
+    the text so far after every delta.
+    """
+    params = {k: v for k, v in kwargs.items() if k in ("temperature", "max_tokens", "top_p", "n")}
+    key = cache_key(kwargs["model"], kwargs.get("messages", []), **params)
+    text = response_cache.get(key)
+    if text is not None:
+        logger.info(f"LLM cache hit {key[:12]}")
+        return text
+
+    with _in_flight_lock:
+        done = _in_flight.get(key)
+        leader = done is None
+        if leader:
+            done = _in_flight[key] = threading.Event()
+    if not leader:
+        done.wait()
+        text = response_cache.get(key)
+        if text is not None:
+            return text
+
+    try:
+        if on_text is not None:
+            parts = []
+            for delta in stream_completion(**kwargs):
+                parts.append(delta)
+                on_text("".join(parts))
+            text = "".join(parts) or None
+        else:
+            response = chat_completion(**kwargs)
+            if not response.choices:
+                return None
+            text = response.choices[0].message.content
+        if text:
+            response_cache.put(key, text, ttl)
+        return text
+    finally:
+        if leader:
+            with _in_flight_lock:
+                del _in_flight[key]
+            done.set()
@@ -4,10 +4,16 @@ import os
 import logging
 import time
 import sys
+import threading
+import numpy as np
 from datetime import datetime, timedelta
-from functools import lru_cache
-from typing import Dict, List, Optional, Union
-import gc
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+from llm import cached_completion
+from price_history import PriceHistory, HISTORY_MAX_COINS
+import quota
 
 # Setup logging
 logging.basicConfig(
@@ -20,7 +26,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price"
+MARKETS_URL = "https://api.coingecko.com/api/v3/coins/markets"
 TRENDING_URL = "https://api.coingecko.com/api/v3/search/trending"
 SENTIMENT_URL = "https://api.coingecko.com/api/v3/coins/{}/sentiment"
 
@@ -28,11 +34,45 @@ MEME_COINS = [
     "pepe", "dogecoin", "floki", "bonk", "wojak", 
     "dogwifhat", "shiba-inu", "baby-doge-coin"
 ]
+if os.getenv("MEME_COINS"):
+    MEME_COINS = [coin.strip() for coin in os.getenv("MEME_COINS").split(",") if coin.strip()]
+
+# Coin universe: "list" scans MEME_COINS, "category" scans a whole CoinGecko category page by page
+MEME_UNIVERSE = os.getenv("MEME_UNIVERSE", "list").lower()
+MEME_CATEGORY = os.getenv("MEME_CATEGORY", "meme-token")
+MARKETS_PAGE_SIZE = 250  # CoinGecko's per_page maximum
+MARKETS_MAX_PAGES = int(os.getenv("MARKETS_MAX_PAGES", 8))
+MAX_SENTIMENT_LOOKUPS = 10  # Only the strongest candidates get a per-coin sentiment request
+MAX_BREAKOUTS = 10
+
+# Short-window momentum from the local price history
+SHORT_WINDOW_MIN_CHANGE = 5  # % move over 1h that counts as a breakout on its own
+PRICE_HISTORY_SAVE_EVERY = 5  # ticks between writes to disk
+# Enough columns for every coin the configured universe can return
+HISTORY_COINS = max(HISTORY_MAX_COINS, MARKETS_PAGE_SIZE * MARKETS_MAX_PAGES if MEME_UNIVERSE == "category" else len(MEME_COINS))
+price_history = PriceHistory.load(max_coins=HISTORY_COINS)
+_history_ticks = 0
+
+# Callables run with each new market snapshot taken by poll_price_history
+price_listeners = []
 
 REQUEST_TIMEOUT = 15  # seconds
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
-CACHE_TTL = 300  # 5 minutes
+
+# Per-endpoint cache policy (seconds): entries are fresh for `ttl`, then served
+# stale while a background refresh runs, until `max_stale` forces a blocking fetch
+PRICE_CACHE_TTL = 60
+PRICE_CACHE_MAX_STALE = 300
+TRENDING_CACHE_TTL = 600
+TRENDING_CACHE_MAX_STALE = 1800
+SENTIMENT_CACHE_TTL = 1800  # Community votes move slowly
+SENTIMENT_CACHE_MAX_STALE = 7200
+ANALYSIS_CACHE_TTL = 300  # GPT analysis of an unchanged market snapshot
+
+# Shared pool for concurrent CoinGecko fetches; every call still goes through the rate limiter
+FETCH_WORKERS = 4
+fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="coingecko")
 
 # Create a session for connection pooling
 session = requests.Session()
@@ -41,58 +81,12 @@ session.headers.update({
     'Accept': 'application/json'
 })
 
-class CoinGeckoRateLimit:
-    def __init__(self, calls_per_minute=30, burst_limit=35, memory_limit_mb=100):
-        self.calls_per_minute = calls_per_minute
-        self.burst_limit = burst_limit
-        self.calls = []
-        self.last_reset = time.time()
-        self.memory_limit = memory_limit_mb * 1024 * 1024  # Convert to bytes
-        
-    def check_memory_usage(self) -> None:
-        """Monitor memory usage of the rate limiter."""
-        try:
-            memory_size = sys.getsizeof(self.calls)
-            if memory_size > self.memory_limit:
-                logger.warning(f"Rate limiter memory usage high: {memory_size / 1024 / 1024:.2f}MB")
-                self.calls = self.calls[-self.calls_per_minute:]  # Keep only recent calls
-                gc.collect()  # Force garbage collection
-        except Exception as e:
-            logger.error(f"Error checking memory usage: {str(e)}")
-        
-    def wait_if_needed(self) -> None:
-        now = time.time()
-        
-        # Reset counter if a minute has passed
-        if now - self.last_reset >= 60:
-            self.calls = []
-            self.last_reset = now
-            self.check_memory_usage()
-            return
-        
-        self.calls = [call for call in self.calls if call > now - 60]
-        
-        if len(self.calls) >= self.calls_per_minute:
-            sleep_time = 60 - (now - self.calls[0])
-            if sleep_time > 0:
-                logger.info(f"Rate limit reached, waiting {sleep_time:.2f} seconds")
-                time.sleep(sleep_time)
-                
-        # Emergency brake for burst protection
-        if len(self.calls) >= self.burst_limit:
-            logger.warning("Burst limit reached, enforcing cooldown")
-            time.sleep(5)  # Force cooldown
-            
-        self.calls.append(now)
-
-rate_limiter = CoinGeckoRateLimit()
-
 def make_request(url: str, params: Optional[Dict] = None, retries: int = MAX_RETRIES) -> Dict:
     """Make a rate-limited request with retries and proper error handling."""
     response = None
     for attempt in range(retries):
         try:
-            rate_limiter.wait_if_needed()
+            quota.acquire("coingecko")
             response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             return response.json()
@@ -110,46 +104,240 @@ def make_request(url: str, params: Optional[Dict] = None, retries: int = MAX_RET
                     raise
     raise Exception("Max retries exceeded")
 
-def ttl_hash(seconds: int = CACHE_TTL):
-    """Return the same value within `seconds` time period."""
-    return round(time.time() / seconds)
+class TTLCache:
+    """Time-based cache with stale-while-revalidate and a hard staleness limit."""
+    def __init__(self, name: str, ttl: float, max_stale: float):
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale_serves": 0, "refreshes": 0, "refresh_errors": 0}
 
-@lru_cache(maxsize=1)
-def fetch_memecoin_prices(vs_currency: str = "usd", _cache_buster: int = ttl_hash()) -> Dict:
-    """Fetch current prices and 24h changes for meme coins."""
-    try:
-        params = {
-            "ids": ",".join(MEME_COINS),
-            "vs_currencies": vs_currency,
-            "include_24hr_change": "true",
-            "include_24hr_vol": "true",
-            "include_market_cap": "true"
+    def reload(self, key, loader):
+        """Call `loader()` regardless of what is cached and store the result for readers of `key`."""
+        value = loader()
+        if self._store(key, value):
+            with self.lock:
+                self.stats["refreshes"] += 1
+        return value
+
+    def get(self, key, loader):
+        """
+        Return the cached value for `key`, calling `loader()` to fill it. Empty
+        results are treated as failures and never cached.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self.stats["hits"] += 1
+                    return value
+                if age < self.max_stale:
+                    self.stats["stale_serves"] += 1
+                    if key not in self.refreshing:
+                        self.refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+                    return value
+            self.stats["misses"] += 1
+
+        value = loader()
+        self._store(key, value)
+        return value
+
+    def _store(self, key, value) -> bool:
+        if not value:
+            return False
+        with self.lock:
+            self.entries[key] = (value, time.time())
+        return True
+
+    def _refresh(self, key, loader) -> None:
+        try:
+            with quota.priority(quota.PRIORITY_BACKGROUND):
+                value = loader()
+            if self._store(key, value):
+                with self.lock:
+                    self.stats["refreshes"] += 1
+            else:
+                with self.lock:
+                    self.stats["refresh_errors"] += 1
+        except Exception as e:
+            with self.lock:
+                self.stats["refresh_errors"] += 1
+            logger.error(f"Background refresh of {self.name} cache failed: {str(e)}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+# All CoinGecko caches by name, for metrics
+caches = {}
+
+def ttl_cache(name: str, ttl: float, max_stale: float):
+    """Decorator caching a function's results per positional/keyword arguments in a TTLCache."""
+    cache = TTLCache(name, ttl, max_stale)
+    caches[name] = cache
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: func(*args, **kwargs))
+
+        def reload(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.reload(key, lambda: func(*args, **kwargs))
+        wrapper.cache = cache
+        wrapper.reload = reload
+        return wrapper
+    return decorator
+
+def cache_stats() -> Dict:
+    """Hit/miss/stale-serve counters for every CoinGecko cache."""
+    stats = {}
+    for name, cache in caches.items():
+        with cache.lock:
+            stats[name] = {**cache.stats, "entries": len(cache.entries)}
+    return stats
+
+class MarketSnapshot:
+    """
+    Columnar market data for a coin universe: one NumPy array per metric,
+    aligned by position with `ids`.
+    """
+    __slots__ = ('ids', 'price', 'change', 'volume', 'market_cap', 'fetched_at', '_positions')
+
+    def __init__(self, ids, price, change, volume, market_cap, fetched_at: Optional[float] = None):
+        self.ids = np.asarray(ids, dtype=object)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.change = np.asarray(change, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+        self.market_cap = np.asarray(market_cap, dtype=np.float64)
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self._positions = None
+
+    @classmethod
+    def from_markets(cls, rows: List[Dict]) -> "MarketSnapshot":
+        """Build from /coins/markets rows, dropping coins without a price."""
+        rows = [row for row in rows if row.get("id") and row.get("current_price") is not None]
+        return cls(
+            [row["id"] for row in rows],
+            [row["current_price"] for row in rows],
+            [row.get("price_change_percentage_24h") or 0 for row in rows],
+            [row.get("total_volume") or 0 for row in rows],
+            [row.get("market_cap") or 0 for row in rows]
+        )
+
+    @classmethod
+    def from_prices(cls, prices: Dict) -> "MarketSnapshot":
+        """Build from the {coin: {price, change, volume, market_cap}} dicts used by fetch_memecoin_prices."""
+        valid = {coin: data for coin, data in prices.items() if isinstance(data, dict) and "change" in data}
+        for coin in prices.keys() - valid.keys():
+            logger.warning(f"Invalid data format for coin {coin}")
+        return cls(
+            list(valid),
+            [data.get("price", 0) for data in valid.values()],
+            [data["change"] for data in valid.values()],
+            [data.get("volume", 0) for data in valid.values()],
+            [data.get("market_cap", 0) for data in valid.values()]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, coin: str) -> Optional[int]:
+        """Index of `coin` in the arrays, or None if it's not in this snapshot."""
+        if self._positions is None:
+            self._positions = {c: i for i, c in enumerate(self.ids.tolist())}
+        return self._positions.get(coin)
+
+    def row(self, i: int) -> Dict:
+        return {
+            "price": float(self.price[i]),
+            "change": float(self.change[i]),
+            "volume": float(self.volume[i]),
+            "market_cap": float(self.market_cap[i])
         }
-        
-        logger.info("Fetching memecoin prices from CoinGecko")
-        data = make_request(COINGECKO_URL, params)
-        
-        if not data:
-            logger.error("No data received from CoinGecko API")
-            return {}
-            
-        result = {}
-        for coin in MEME_COINS:
-            if coin in data:
-                result[coin] = {
-                    "price": data[coin][vs_currency],
-                    "change": data[coin].get(f"{vs_currency}_24h_change", 0),
-                    "volume": data[coin].get(f"{vs_currency}_24h_vol", 0),
-                    "market_cap": data[coin].get(f"{vs_currency}_market_cap", 0)
-                }
-                
-        logger.info(f"Successfully fetched prices for {len(result)} meme coins")
-        return result
-        
+
+    def to_prices(self) -> Dict:
+        return {coin: self.row(i) for i, coin in enumerate(self.ids)}
+
+def fetch_markets_page(vs_currency: str, page: int, ids: Optional[List[str]] = None) -> List[Dict]:
+    params = {
+        "vs_currency": vs_currency,
+        "per_page": MARKETS_PAGE_SIZE,
+        "page": page,
+        "price_change_percentage": "24h"
+    }
+    if ids:
+        params["ids"] = ",".join(ids)
+    else:
+        params["category"] = MEME_CATEGORY
+    return make_request(MARKETS_URL, params) or []
+
+@ttl_cache("markets", PRICE_CACHE_TTL, PRICE_CACHE_MAX_STALE)
+def fetch_market_snapshot(vs_currency: str = "usd") -> Optional[MarketSnapshot]:
+    """Fetch the whole coin universe with bulk /coins/markets requests."""
+    try:
+        rows = []
+        if MEME_UNIVERSE == "category":
+            logger.info(f"Scanning CoinGecko category '{MEME_CATEGORY}'")
+            for page in range(1, MARKETS_MAX_PAGES + 1):
+                data = fetch_markets_page(vs_currency, page)
+                rows.extend(data)
+                if len(data) < MARKETS_PAGE_SIZE:
+                    break
+        else:
+            chunks = [MEME_COINS[i:i + MARKETS_PAGE_SIZE] for i in range(0, len(MEME_COINS), MARKETS_PAGE_SIZE)]
+            logger.info(f"Fetching {len(MEME_COINS)} meme coins in {len(chunks)} requests")
+            futures = [quota.submit(fetch_executor, fetch_markets_page, vs_currency, 1, chunk) for chunk in chunks]
+            for future in futures:
+                rows.extend(future.result())
+
+        snapshot = MarketSnapshot.from_markets(rows)
+        if not len(snapshot):
+            logger.error("No market data received from CoinGecko API")
+            return None
+
+        logger.info(f"Successfully fetched market data for {len(snapshot)} meme coins")
+        return snapshot
+
     except Exception as e:
-        logger.error(f"Error fetching memecoin prices: {str(e)}", exc_info=True)
-        return {}
+        logger.error(f"Error fetching meme coin markets: {str(e)}", exc_info=True)
+        return None
 
+def poll_price_history() -> None:
+    """Scheduler job: add the latest market snapshot to the price history ring buffer."""
+    global _history_ticks
+    try:
+        # Always fetch fresh: a cached snapshot may be the one already recorded
+        # last tick. The result also refreshes the cache for other readers.
+        with quota.priority(quota.PRIORITY_BACKGROUND):
+            snapshot = fetch_market_snapshot.reload()
+        if not snapshot:
+            return
+        if price_history.append(snapshot.ids, snapshot.price, snapshot.volume, snapshot.fetched_at):
+            _history_ticks += 1
+            if _history_ticks % PRICE_HISTORY_SAVE_EVERY == 0:
+                price_history.save()
+            for listener in price_listeners:
+                try:
+                    listener(snapshot)
+                except Exception as e:
+                    logger.error(f"Price listener {listener.__name__} failed: {str(e)}", exc_info=True)
+    except Exception as e:
+        logger.error(f"Error polling price history: {str(e)}", exc_info=True)
+
+def fetch_memecoin_prices(vs_currency: str = "usd") -> Dict:
+    """Fetch current prices and 24h changes for meme coins."""
+    snapshot = fetch_market_snapshot(vs_currency)
+    return snapshot.to_prices() if snapshot else {}
+
+@ttl_cache("sentiment", SENTIMENT_CACHE_TTL, SENTIMENT_CACHE_MAX_STALE)
 def fetch_coin_sentiment(coin_id: str) -> Optional[Dict]:
     """Fetch social sentiment data for a specific coin."""
     try:
@@ -164,25 +352,29 @@ def fetch_coin_sentiment(coin_id: str) -> Optional[Dict]:
         logger.warning(f"Could not fetch sentiment for {coin_id}: {str(e)}")
         return None
 
-def calculate_market_metrics(prices: Dict) -> Dict:
+def fetch_sentiments(coin_ids: List[str]) -> Dict[str, Optional[Dict]]:
+    """Fetch sentiment for several coins concurrently; cached coins return without a request."""
+    futures = {coin: quota.submit(fetch_executor, fetch_coin_sentiment, coin) for coin in coin_ids}
+    return {coin: future.result() for coin, future in futures.items()}
+
+def calculate_market_metrics(prices: Union[Dict, MarketSnapshot]) -> Dict:
     """Calculate market-wide metrics for meme coins."""
     try:
-        if not prices:
+        snapshot = prices if isinstance(prices, MarketSnapshot) else MarketSnapshot.from_prices(prices or {})
+        if not len(snapshot):
             return {}
             
-        total_market_cap = sum(coin["market_cap"] for coin in prices.values())
-        total_volume = sum(coin["volume"] for coin in prices.values())
-        avg_change = sum(coin["change"] for coin in prices.values()) / len(prices)
+        total_market_cap = float(snapshot.market_cap.sum())
+        total_volume = float(snapshot.volume.sum())
+        avg_change = float(snapshot.change.mean())
         
         # Calculate volatility and additional metrics
-        changes = [coin["change"] for coin in prices.values()]
-        volatility = sum((c - avg_change) ** 2 for c in changes) / len(changes)
+        volatility = float(snapshot.change.var())
         
         # Add market dominance calculation
-        market_dominance = {
-            coin: (data["market_cap"] / total_market_cap * 100) 
-            for coin, data in prices.items()
-        }
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dominance = snapshot.market_cap / total_market_cap * 100
+        market_dominance = dict(zip(snapshot.ids.tolist(), dominance.tolist()))
         
         return {
             "total_market_cap": total_market_cap,
@@ -195,49 +387,74 @@ def calculate_market_metrics(prices: Dict) -> Dict:
         logger.error(f"Error calculating market metrics: {str(e)}", exc_info=True)
         return {}
 
-def top_meme_breakouts(prices: Dict, min_percent_change: float = 10) -> List:
-    """Identify breakout meme coins based on price action and volume."""
+def top_meme_breakouts(prices: Union[Dict, MarketSnapshot], min_percent_change: float = 10,
+                       max_results: int = MAX_BREAKOUTS, history: Optional[PriceHistory] = None) -> List:
+    """
+    Identify breakout meme coins based on price action and volume. With a
+    `history`, a 1h move of SHORT_WINDOW_MIN_CHANGE also qualifies and short-window
+    changes feed into the ranking, so fresh pumps surface before the 24h number moves.
+    """
     try:
-        if not prices:
+        snapshot = prices if isinstance(prices, MarketSnapshot) else MarketSnapshot.from_prices(prices or {})
+        if not len(snapshot):
             return []
             
-        movers = []
-        avg_volume = sum(data["volume"] for data in prices.values()) / len(prices)
-        
-        for coin, data in prices.items():
-            if not isinstance(data, dict) or "change" not in data:
-                logger.warning(f"Invalid data format for coin {coin}")
-                continue
-                
-            # Enhanced breakout detection
-            price_significant = abs(data["change"]) >= min_percent_change
-            volume_significant = data["volume"] > avg_volume * 1.5
-            
-            if price_significant or volume_significant:
-                sentiment = fetch_coin_sentiment(coin)
-                
-                movers.append((coin, {
-                    **data,
-                    "sentiment": sentiment if sentiment else {"sentiment_votes_up_percentage": 50},
-                    "volume_ratio": data["volume"] / avg_volume if avg_volume else 1
-                }))
-                
+        avg_volume = snapshot.volume.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            volume_ratio = snapshot.volume / avg_volume if avg_volume else np.ones(len(snapshot))
+
+        # Enhanced breakout detection
+        price_significant = np.abs(snapshot.change) >= min_percent_change
+        volume_significant = snapshot.volume > avg_volume * 1.5
+        significant = price_significant | volume_significant
+
+        momentum = history.momentum(snapshot.ids) if history is not None else {}
+        move = np.abs(snapshot.change)
+        if momentum:
+            change_1h = np.nan_to_num(momentum["change_1h"])
+            significant |= np.abs(change_1h) >= SHORT_WINDOW_MIN_CHANGE
+            move = move + np.abs(change_1h)
+        candidates = np.flatnonzero(significant)
+
+        # Rank on price and volume first; only the strongest get a sentiment lookup
+        base_score = move[candidates] * volume_ratio[candidates]
+        ranked = candidates[np.argsort(-base_score, kind='stable')]
+        sentiments = fetch_sentiments(snapshot.ids[ranked[:MAX_SENTIMENT_LOOKUPS]].tolist())
+
+        sentiment_up = np.full(len(ranked), 50.0)
+        for j, i in enumerate(ranked[:MAX_SENTIMENT_LOOKUPS]):
+            sentiment = sentiments.get(snapshot.ids[i])
+            if sentiment:
+                sentiment_up[j] = sentiment["sentiment_votes_up_percentage"]
+
         # Sort by combined score of price change, volume, and sentiment
-        movers.sort(key=lambda x: (
-            abs(x[1]["change"]) * 
-            (x[1]["volume_ratio"]) * 
-            (x[1]["sentiment"]["sentiment_votes_up_percentage"] / 50)
-        ), reverse=True)
-        
-        logger.info(f"Found {len(movers)} breakout coins")
+        score = move[ranked] * volume_ratio[ranked] * (sentiment_up / 50)
+        order = np.argsort(-score, kind='stable')[:max_results]
+
+        movers = []
+        for j in order:
+            i = ranked[j]
+            coin = snapshot.ids[i]
+            sentiment = sentiments.get(coin)
+            info = {
+                **snapshot.row(i),
+                "sentiment": sentiment if sentiment else {"sentiment_votes_up_percentage": 50},
+                "volume_ratio": float(volume_ratio[i])
+            }
+            for key, values in momentum.items():
+                if not np.isnan(values[i]):
+                    info[key] = float(values[i])
+            movers.append((coin, info))
+
+        logger.info(f"Found {len(candidates)} breakout coins out of {len(snapshot)}, reporting {len(movers)}")
         return movers
         
     except Exception as e:
         logger.error(f"Error in top_meme_breakouts: {str(e)}", exc_info=True)
         return []
 
-@lru_cache(maxsize=1)
-def fetch_trending_coins(_cache_buster: int = ttl_hash()) -> List:
+@ttl_cache("trending", TRENDING_CACHE_TTL, TRENDING_CACHE_MAX_STALE)
+def fetch_trending_coins() -> List:
     """Fetch trending coins from CoinGecko."""
     try:
         logger.info("Fetching trending coins from CoinGecko")
@@ -261,8 +478,10 @@ def fetch_trending_coins(_cache_buster: int = ttl_hash()) -> List:
         logger.error(f"Error fetching trending coins: {str(e)}", exc_info=True)
         return []
 
-def ask_gpt_memecoin_breakout(breakouts: List, trending: List, openai_api_key: str) -> str:
-    """Generate AI analysis of meme coin movements."""
+def ask_gpt_memecoin_breakout(breakouts: List, trending: List, openai_api_key: str,
+                              universe: Optional[set] = None,
+                              on_text: Optional[Callable[[str], None]] = None) -> str:
+    """Generate AI analysis of meme coin movements, streaming partial text to `on_text` if given."""
     try:
         if not openai_api_key:
             logger.error("OpenAI API key not configured")
@@ -286,10 +505,19 @@ def ask_gpt_memecoin_breakout(breakouts: List, trending: List, openai_api_key: s
                 f"| Market Dom: {market_dom:.1f}% "
                 f"| Sentiment: {'🟢' if sentiment > 50 else '🔴'} {sentiment:.0f}%"
             )
+            short_term = " ".join(
+                f"{label}: {info[f'change_{label}']:+.2f}%"
+                for label in ("15m", "1h", "4h") if f"change_{label}" in info
+            )
+            if short_term:
+                coins_info[-1] += f" | {short_term}"
+                if "volume_change_1h" in info:
+                    coins_info[-1] += f" | 24h vol {info['volume_change_1h']:+.1f}% in 1h"
         coins_text = "\n".join(coins_info) or "No major price breakouts detected."
 
         # Format trending coins information
-        trending_memes = [t for t in trending if t["id"] in MEME_COINS]
+        universe = universe if universe is not None else set(MEME_COINS)
+        trending_memes = [t for t in trending if t["id"] in universe]
         trending_text = "\n".join([
             f"{t['symbol'].upper()}: Rank #{t['market_cap_rank']} "
             f"(Score: {t['score']:.1f}, BTC: {t['price_btc']:.8f})"
@@ -327,7 +555,9 @@ Sign off with: "Generated by Nova Stratos 🤖"
         logger.info("Requesting AI analysis for meme coins")
         
         try:
-            response = openai.chat.completions.create(
+            analysis = cached_completion(
+                ANALYSIS_CACHE_TTL,
+                on_text=on_text,
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "You are Nova Stratos, an AI quant analyst specializing in meme coin momentum and social sentiment analysis."},
@@ -338,12 +568,12 @@ Sign off with: "Generated by Nova Stratos 🤖"
                 timeout=20
             )
             
-            if not response.choices:
+            if analysis is None:
                 logger.error("No response from OpenAI API")
                 return "Error: Could not generate analysis"
                 
             logger.info("Successfully generated meme coin analysis")
-            return response.choices[0].message.content
+            return analysis
 
         except openai.error.Timeout:
             logger.error("OpenAI API timeout")
@@ -359,20 +589,23 @@ Sign off with: "Generated by Nova Stratos 🤖"
         logger.error(f"Unexpected error in ask_gpt_memecoin_breakout: {str(e)}", exc_info=True)
         return "⚠️ Could not complete meme coin analysis"
 
-def nova_memesnipe(openai_api_key: str) -> str:
+def nova_memesnipe(openai_api_key: str, on_text: Optional[Callable[[str], None]] = None) -> str:
     """Main function to analyze meme coin opportunities."""
     try:
         logger.info("Starting meme coin analysis")
         start_time = time.time()
         
-        prices = fetch_memecoin_prices()
-        if not prices:
+        # Trending doesn't depend on prices, so fetch it alongside
+        trending_future = quota.submit(fetch_executor, fetch_trending_coins)
+
+        snapshot = fetch_market_snapshot()
+        if not snapshot:
             return "⚠️ Could not fetch meme coin data"
             
-        movers = top_meme_breakouts(prices, min_percent_change=10)
-        trending = fetch_trending_coins()
+        movers = top_meme_breakouts(snapshot, min_percent_change=10, history=price_history)
+        trending = trending_future.result()
         
-        analysis = ask_gpt_memecoin_breakout(movers, trending, openai_api_key)
+        analysis = ask_gpt_memecoin_breakout(movers, trending, openai_api_key, set(snapshot.ids.tolist()), on_text)
         
         duration = time.time() - start_time
         logger.info(f"Completed meme coin analysis in {duration:.2f}s")
@@ -386,6 +619,8 @@ def nova_memesnipe(openai_api_key: str) -> str:
 def cleanup():
     """Cleanup resources when shutting down."""
     try:
+        price_history.save()
+        fetch_executor.shutdown(wait=False)
         session.close()
         logger.info("Cleaned up HTTP session")
     except Exception as e:
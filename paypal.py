@@ -1,11 +1,15 @@
 import requests
 import logging
+import math
+import os
 import re
+import sqlite3
+import threading
 import time
 import hashlib
-from typing import Dict, Tuple, Optional, Set
+import json
+from typing import Callable, Dict, Tuple, Optional, Set
 from datetime import datetime, timedelta
-from collections import OrderedDict
 
 # Setup logging
 logging.basicConfig(
@@ -26,7 +30,15 @@ MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
 PAYMENT_AMOUNT = 97.00
 ACCEPTED_CURRENCIES = {'USD', 'EUR', 'GBP'}
-MAX_PROCESSED_PAYMENTS = 1000  # Maximum number of processed payment hashes to store
+PAYMENTS_DB_PATH = os.getenv('PAYMENTS_DB_PATH', os.path.join('data', 'payments.db'))
+PAYMENT_RETENTION_HOURS = 7 * 24  # PayPal keeps retrying an IPN for up to four days
+CLEANUP_INTERVAL = 3600  # seconds between expiry sweeps
+BLOOM_CAPACITY = 100000
+BLOOM_ERROR_RATE = 0.01
+OUTBOX_POLL_INTERVAL = 5  # seconds between outbox scans when nothing new arrives
+OUTBOX_LEASE = 300  # seconds an IPN stays claimed by the verifier working on it
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_MAX_BACKOFF = 6 * 3600
 
 # Create a session for connection pooling
 session = requests.Session()
@@ -39,30 +51,108 @@ class PayPalIPNError(Exception):
     """Custom exception for PayPal IPN errors."""
     pass
 
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over hex digests. A negative answer is certain,
+    a positive one may be wrong about 1% of the time at `capacity` items.
+    """
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: str):
+        # Split the SHA-256 digest into independent 32-bit indexes
+        for i in range(self.hashes):
+            chunk = digest[(i * 8) % 64:(i * 8) % 64 + 8]
+            yield (int(chunk, 16) + i * 0x9E3779B1) % self.size
+
+    def add(self, digest: str) -> None:
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
 class ProcessedPayments:
-    """Thread-safe storage for processed payment hashes with automatic cleanup."""
-    def __init__(self, max_size: int = MAX_PROCESSED_PAYMENTS):
-        self.max_size = max_size
-        self.payments = OrderedDict()
-        
+    """
+    Durable store of processed payment hashes, shared by every worker process.
+
+    Hashes live in a SQLite table whose primary key is the on-disk index and
+    whose processed_at index lets expiry delete only the expired rows. An
+    in-memory Bloom filter sits in front, so checking a payment that was never
+    seen doesn't touch disk. Expiry leaves the filter alone: a stale bit only
+    costs an indexed lookup that finds nothing. `claim` is an atomic insert, which is what keeps
+    two processes from handling the same payment.
+    """
+    def __init__(self, path: str = PAYMENTS_DB_PATH, max_age_hours: int = PAYMENT_RETENTION_HOURS):
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.lock = threading.Lock()
+        self._last_cleanup = 0.0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS processed_payments ("
+            "payment_hash TEXT PRIMARY KEY, processed_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS processed_payments_age ON processed_payments (processed_at)")
+        self._rebuild_filter()
+
+    def _rebuild_filter(self) -> None:
+        bloom = BloomFilter()
+        for (payment_hash,) in self.db.execute("SELECT payment_hash FROM processed_payments"):
+            bloom.add(payment_hash)
+        self.bloom = bloom
+
+    def claim(self, payment_hash: str) -> bool:
+        """Mark a payment processed. False if it already was (by any process)."""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO processed_payments (payment_hash, processed_at) VALUES (?, ?)",
+                (payment_hash, time.time())
+            )
+            self.bloom.add(payment_hash)
+            return cursor.rowcount == 1
+
     def add(self, payment_hash: str) -> None:
         """Add a payment hash with timestamp."""
-        self.payments[payment_hash] = time.time()
-        if len(self.payments) > self.max_size:
-            # Remove oldest entries
-            while len(self.payments) > self.max_size * 0.8:  # Remove 20% when full
-                self.payments.popitem(last=False)
-                
+        self.claim(payment_hash)
+
+    def release(self, payment_hash: str) -> None:
+        """Forget a claimed payment whose processing failed, so a redelivery can retry it."""
+        with self.lock:
+            self.db.execute("DELETE FROM processed_payments WHERE payment_hash = ?", (payment_hash,))
+
     def __contains__(self, payment_hash: str) -> bool:
         """Check if payment hash exists."""
-        return payment_hash in self.payments
-        
-    def cleanup_old_entries(self, max_age_hours: int = 24) -> None:
-        """Remove entries older than max_age_hours."""
-        cutoff_time = time.time() - (max_age_hours * 3600)
-        for payment_hash, timestamp in list(self.payments.items()):
-            if timestamp < cutoff_time:
-                del self.payments[payment_hash]
+        # Another process may have added it since our filter was built; the
+        # claim in process_ipn is the authoritative check
+        if payment_hash not in self.bloom:
+            return False
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM processed_payments WHERE payment_hash = ?", (payment_hash,)
+            ).fetchone()
+        return row is not None
+
+    def cleanup_old_entries(self, max_age_hours: Optional[int] = None) -> int:
+        """Delete entries older than the retention window. Returns how many were removed."""
+        max_age = self.max_age if max_age_hours is None else max_age_hours * 3600
+        with self.lock:
+            self._last_cleanup = time.time()
+            removed = self.db.execute(
+                "DELETE FROM processed_payments WHERE processed_at < ?", (time.time() - max_age,)
+            ).rowcount
+        if removed:
+            logger.info(f"Expired {removed} processed payment records")
+        return removed
+
+    def maybe_cleanup(self) -> None:
+        """Run cleanup_old_entries at most once per CLEANUP_INTERVAL."""
+        if time.time() - self._last_cleanup >= CLEANUP_INTERVAL:
+            self.cleanup_old_entries()
 
 # Global storage for processed payments
 processed_payments = ProcessedPayments()
@@ -104,7 +194,7 @@ def verify_ipn(data: Dict, sandbox: bool = False) -> bool:
                 raise PayPalIPNError(f"IPN verification failed after {MAX_RETRIES} attempts")
             time.sleep(RETRY_DELAY * (attempt + 1))
             
-    return False
+    raise PayPalIPNError(f"IPN verification timed out after {MAX_RETRIES} attempts")
 
 def validate_ipn_data(data: Dict) -> Tuple[bool, Optional[str]]:
     """
@@ -170,13 +260,16 @@ def calculate_ipn_hash(data: Dict) -> str:
     # Calculate SHA-256 hash
     return hashlib.sha256(hash_input.encode()).hexdigest()
 
-def process_ipn(data: Dict, bot_token: str) -> Tuple[str, int]:
+def process_ipn(data: Dict, bot_token: str, on_paid: Optional[Callable[[str, str], None]] = None,
+                send_welcome: bool = True) -> Tuple[str, int]:
     """
     Process PayPal IPN with enhanced validation.
     
     Args:
         data: The IPN data to process
         bot_token: Telegram bot token
+        on_paid: Called with the username and txn_id once a payment is verified, before any DM
+        send_welcome: Whether to DM the welcome message to @username
         
     Returns:
         Tuple[str, int]: (response_message, http_status_code)
@@ -185,8 +278,8 @@ def process_ipn(data: Dict, bot_token: str) -> Tuple[str, int]:
         start_time = time.time()
         logger.info("Starting IPN processing")
         
-        # Cleanup old processed payments periodically
-        processed_payments.cleanup_old_entries()
+        # Expire old processed payments periodically
+        processed_payments.maybe_cleanup()
         
         # Basic validation
         is_valid, error_msg = validate_ipn_data(data)
@@ -210,13 +303,23 @@ def process_ipn(data: Dict, bot_token: str) -> Tuple[str, int]:
             logger.info(f"Duplicate IPN detected: {data.get('txn_id')}")
             return "OK", 200
             
-        # Process the payment
+        # Claim it atomically so no other worker handles it too
+        if not processed_payments.claim(txn_hash):
+            logger.info(f"Duplicate IPN detected: {data.get('txn_id')}")
+            return "OK", 200
+
+        # Process the payment: record it first, so a failed DM can't lose the member
         try:
             username = data['custom'].strip()
-            from telegram import send_welcome_dm  # Avoid circular import
-            
-            send_welcome_dm(username, bot_token)
-            processed_payments.add(txn_hash)
+            if on_paid:
+                on_paid(username, data.get('txn_id'))
+
+            if send_welcome:
+                from telegram import send_welcome_dm  # Avoid circular import
+
+                # A permanent refusal (e.g. "chat not found") won't improve with retries
+                if not send_welcome_dm(f"@{username}", bot_token):
+                    logger.warning(f"Welcome DM to @{username} refused; payment recorded without it")
             
             duration = time.time() - start_time
             logger.info(
@@ -228,21 +331,166 @@ def process_ipn(data: Dict, bot_token: str) -> Tuple[str, int]:
             return "OK", 200
             
         except Exception as e:
-            logger.error(f"Failed to send welcome DM: {str(e)}", exc_info=True)
-            return "Failed to send welcome message", 500
+            # Transient failure: let a redelivery process it again (on_paid is idempotent)
+            processed_payments.release(txn_hash)
+            logger.error(f"Failed to process payment: {str(e)}", exc_info=True)
+            return "Failed to process payment", 503
             
     except PayPalIPNError as e:
+        # PayPal couldn't be reached; worth trying again later
         logger.error(f"PayPal IPN Error: {str(e)}", exc_info=True)
-        return "PayPal IPN verification failed", 400
+        return "PayPal IPN verification failed", 503
     except Exception as e:
         logger.error(f"Unexpected error in process_ipn: {str(e)}", exc_info=True)
         return "Server error", 500
 
+class IPNOutbox:
+    """
+    Durable queue of received IPNs awaiting verification.
+
+    The webhook only validates an IPN and appends it here, which commits to
+    disk before PayPal gets its 200. A background verifier thread then does
+    the slow `_notify-validate` round trip and the welcome DM through
+    `handler`, retrying with exponential backoff. Each row is leased before
+    it is worked on, so several processes can share the outbox and a crash
+    mid-verification only delays the IPN until the lease runs out.
+    """
+    def __init__(self, path: str = PAYMENTS_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"received": 0, "processed": 0, "retries": 0, "failed": 0}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ipn_outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, received_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', last_error TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS ipn_outbox_due ON ipn_outbox (status, next_attempt_at)")
+
+    def put(self, data: Dict) -> int:
+        """Durably store an IPN for verification. Returns its outbox id."""
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO ipn_outbox (payload, received_at, next_attempt_at) VALUES (?, ?, ?)",
+                (json.dumps(data), now, now)
+            )
+            self._stats["received"] += 1
+        self.wakeup.set()
+        return cursor.lastrowid
+
+    def _lease_due(self, limit: int = 10):
+        """Claim up to `limit` due IPNs for this verifier by pushing their next attempt past the lease."""
+        now = time.time()
+        leased = []
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, payload, attempts FROM ipn_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, limit)
+            ).fetchall()
+            for outbox_id, payload, attempts in rows:
+                claimed = self.db.execute(
+                    "UPDATE ipn_outbox SET next_attempt_at = ? WHERE id = ? AND next_attempt_at <= ?",
+                    (now + OUTBOX_LEASE, outbox_id, now)
+                ).rowcount
+                if claimed:
+                    leased.append((outbox_id, json.loads(payload), attempts))
+        return leased
+
+    def _finish(self, outbox_id: int) -> None:
+        with self.lock:
+            self.db.execute("DELETE FROM ipn_outbox WHERE id = ?", (outbox_id,))
+            self._stats["processed"] += 1
+
+    def _retry(self, outbox_id: int, attempts: int, error: str) -> None:
+        attempts += 1
+        with self.lock:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                self.db.execute(
+                    "UPDATE ipn_outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, outbox_id)
+                )
+                self._stats["failed"] += 1
+                logger.error(f"Giving up on IPN {outbox_id} after {attempts} attempts: {error}")
+                return
+            delay = min(RETRY_DELAY * 30 * 2 ** attempts, OUTBOX_MAX_BACKOFF)
+            self.db.execute(
+                "UPDATE ipn_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, error, outbox_id)
+            )
+            self._stats["retries"] += 1
+        logger.warning(f"IPN {outbox_id} attempt {attempts} failed ({error}), retrying in {delay}s")
+
+    def _fail(self, outbox_id: int, error: str) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE ipn_outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, outbox_id)
+            )
+            self._stats["failed"] += 1
+        logger.warning(f"IPN {outbox_id} rejected: {error}")
+
+    def drain(self, handler: Callable[[Dict], Tuple[str, int]]) -> int:
+        """Run `handler` on every due IPN. 2xx is done, 4xx is rejected for good, anything else is retried."""
+        handled = 0
+        while True:
+            batch = self._lease_due()
+            if not batch:
+                return handled
+            for outbox_id, data, attempts in batch:
+                try:
+                    message, status = handler(data)
+                except Exception as e:
+                    message, status = str(e), 500
+                if 200 <= status < 300:
+                    self._finish(outbox_id)
+                elif 400 <= status < 500:
+                    self._fail(outbox_id, message)
+                else:
+                    self._retry(outbox_id, attempts, message)
+                handled += 1
+
+    def start(self, handler: Callable[[Dict], Tuple[str, int]]) -> None:
+        """Start the background verifier thread."""
+        def run():
+            logger.info("IPN verifier started")
+            while not self._stop.is_set():
+                try:
+                    self.drain(handler)
+                except Exception as e:
+                    logger.error(f"IPN verifier error: {str(e)}", exc_info=True)
+                self.wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self.wakeup.clear()
+
+        self._thread = threading.Thread(target=run, name="ipn-verifier", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.wakeup.set()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            stats = dict(self._stats)
+            stats["queued"] = dict(self.db.execute("SELECT status, COUNT(*) FROM ipn_outbox GROUP BY status").fetchall())
+        return stats
+
+# Durable queue between the IPN webhook and the background verifier
+ipn_outbox = IPNOutbox()
+
 def cleanup():
     """Cleanup resources when shutting down."""
     try:
         session.close()
-        logger.info("Cleaned up HTTP session")
+        ipn_outbox.stop()
+        processed_payments.db.close()
+        logger.info("Cleaned up HTTP session and payment store")
     except Exception as e:
         logger.error(f"Error during cleanup: {str(e)}")
 
@@ -0,0 +1,110 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import quota
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/pipeline.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+class StageError(Exception):
+    """Raised by a stage to signal that it produced no usable result."""
+    pass
+
+class Stage:
+    def __init__(self, name: str, func: Callable, deps: Iterable[str] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+
+class StageGraph:
+    """
+    Small dependency graph of pipeline stages run concurrently on a thread pool.
+
+    Each stage is called with the results of its dependencies as positional
+    arguments, in the order the dependencies were declared. A stage that raises
+    or runs past its timeout has no result, and every stage depending on it is
+    skipped. Per-stage wall times are kept in `timings`.
+    """
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        self.max_workers = max_workers
+        self.stages = {}
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = (), timeout: Optional[float] = None) -> "StageGraph":
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, func, deps, timeout)
+        return self
+
+    def _call(self, stage: Stage, args: tuple) -> Any:
+        started = time.time()
+        try:
+            return stage.func(*args)
+        finally:
+            self.timings[stage.name] = time.time() - started
+
+    def run(self) -> Dict[str, Any]:
+        """Run every stage once and return the results of the stages that succeeded."""
+        start_time = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        waiting = dict(self.stages)
+        running = {}
+        try:
+            while waiting or running:
+                for name, stage in list(waiting.items()):
+                    if any(dep in self.errors for dep in stage.deps):
+                        self.errors[name] = "skipped: upstream stage failed"
+                        del waiting[name]
+                    elif all(dep in self.results for dep in stage.deps):
+                        args = tuple(self.results[dep] for dep in stage.deps)
+                        deadline = time.time() + stage.timeout if stage.timeout else None
+                        running[quota.submit(executor, self._call, stage, args)] = (stage, deadline)
+                        del waiting[name]
+
+                if not running:
+                    continue
+
+                deadlines = [d for _, d in running.values() if d is not None]
+                timeout = max(min(deadlines) - time.time(), 0) if deadlines else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, _ = running.pop(future)
+                    try:
+                        self.results[stage.name] = future.result()
+                    except Exception as e:
+                        self.errors[stage.name] = str(e)
+                        logger.error(f"{self.name}: stage '{stage.name}' failed: {str(e)}")
+
+                now = time.time()
+                for future, (stage, deadline) in list(running.items()):
+                    if deadline is not None and now >= deadline:
+                        future.cancel()
+                        running.pop(future)
+                        self.errors[stage.name] = f"timed out after {stage.timeout}s"
+                        self.timings.setdefault(stage.name, now - deadline + stage.timeout)
+                        logger.error(f"{self.name}: stage '{stage.name}' timed out after {stage.timeout}s")
+        finally:
+            # Don't block on stages abandoned after a timeout
+            executor.shutdown(wait=False)
+
+        total = time.time() - start_time
+        summary = ", ".join(f"{name}={duration:.2f}s" for name, duration in self.timings.items())
+        logger.info(f"{self.name} finished in {total:.2f}s ({summary})")
+        self.timings["total"] = total
+        return self.results
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from broadcast import call_telegram, TelegramAPIError
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/poller.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+OFFSET_PATH = os.getenv('POLL_OFFSET_PATH', os.path.join('data', 'poll_offset'))
+POLL_BATCH_SIZE = 100      # getUpdates maximum
+POLL_TIMEOUT = 50          # seconds Telegram holds an empty long poll open
+POLL_WORKERS = int(os.getenv('POLL_WORKERS', 8))
+ALLOWED_UPDATES = ["message", "channel_post"]
+POLL_MAX_ATTEMPTS = 5      # failed deliveries of one update before it is skipped
+
+class UpdateRetry(Exception):
+    """Raised by poll_once when an update failed and will be fetched again."""
+    pass
+
+class UpdatePoller:
+    """
+    getUpdates long-polling loop, an alternative to receiving updates on /webhook.
+
+    Each batch of up to 100 updates is handed to `handler(update)` on a
+    worker pool. Once the batch is handled the next offset is written to disk
+    (and confirmed to Telegram by the next getUpdates), so after a restart
+    polling picks up where it left off without replaying handled updates.
+
+    The handler reports failure by raising or returning False. The offset then
+    stops at the first failed update, so getUpdates delivers it again; later
+    updates in the batch come back too, and the handler is expected to skip
+    those it already handled. An update that fails `POLL_MAX_ATTEMPTS` times
+    is skipped so it can't stall polling.
+    """
+    def __init__(self, bot_token: str, handler: Callable[[Dict], Optional[bool]], workers: int = POLL_WORKERS, offset_path: Optional[str] = OFFSET_PATH):
+        self.bot_token = bot_token
+        self.handler = handler
+        self.offset_path = offset_path
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="poller")
+        self.offset = self._load_offset()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._attempts = {}  # update_id -> failed deliveries so far
+        self._stats = {"polls": 0, "updates": 0, "failed": 0, "skipped": 0, "errors": 0, "largest_batch": 0}
+
+    def _load_offset(self) -> Optional[int]:
+        if not self.offset_path:
+            return None
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Could not read poll offset from {self.offset_path}: {str(e)}")
+            return None
+
+    def _save_offset(self) -> None:
+        if not self.offset_path:
+            return
+        try:
+            with atomic_write(self.offset_path) as f:
+                f.write(str(self.offset))
+        except Exception as e:
+            logger.error(f"Failed to save poll offset: {str(e)}")
+
+    def fetch(self) -> List[Dict]:
+        payload = {"limit": POLL_BATCH_SIZE, "timeout": POLL_TIMEOUT, "allowed_updates": ALLOWED_UPDATES}
+        if self.offset is not None:
+            payload["offset"] = self.offset
+        return call_telegram(self.bot_token, "getUpdates", payload, timeout=POLL_TIMEOUT + 10)
+
+    def _handle(self, update: Dict) -> bool:
+        try:
+            if self.handler(update) is not False:
+                return True
+            logger.error(f"Update {update.get('update_id')} failed")
+        except Exception as e:
+            logger.error(f"Update {update.get('update_id')} failed: {str(e)}", exc_info=True)
+        with self._lock:
+            self._stats["failed"] += 1
+        return False
+
+    def poll_once(self) -> int:
+        """Fetch and handle one batch. Returns the number of updates handled, or raises UpdateRetry."""
+        updates = self.fetch()
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["updates"] += len(updates)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(updates))
+        if not updates:
+            return 0
+
+        futures = [self.executor.submit(self._handle, update) for update in updates]
+        wait(futures)
+
+        retry = None
+        next_offset = self.offset
+        for update, future in zip(updates, futures):
+            update_id = update.get("update_id")
+            if update_id is None:
+                continue
+            if not future.result():
+                attempts = self._attempts.get(update_id, 0) + 1
+                if attempts < POLL_MAX_ATTEMPTS:
+                    self._attempts[update_id] = attempts
+                    retry = update_id
+                    break
+                logger.error(f"Skipping update {update_id} after {attempts} failed attempts")
+                with self._lock:
+                    self._stats["skipped"] += 1
+            self._attempts.pop(update_id, None)
+            next_offset = update_id + 1
+
+        if next_offset != self.offset:
+            self.offset = next_offset
+            self._save_offset()
+        if retry is not None:
+            raise UpdateRetry(f"update {retry} failed (attempt {self._attempts[retry]} of {POLL_MAX_ATTEMPTS})")
+        return len(updates)
+
+    def run(self) -> None:
+        """Poll until stop() is called, backing off on errors."""
+        logger.info(f"Long polling for updates (offset {self.offset})")
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                handled = self.poll_once()
+                if handled:
+                    logger.info(f"Handled {handled} updates, next offset {self.offset}")
+                backoff = 1
+            except UpdateRetry as e:
+                logger.warning(f"Refetching from {self.offset} in {backoff}s: {str(e)}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            except (TelegramAPIError, requests.exceptions.RequestException) as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                retry_after = getattr(e, "retry_after", None)
+                delay = retry_after or backoff
+                # 409 means a webhook is still set, or another poller is running
+                logger.error(f"getUpdates failed, retrying in {delay}s: {str(e)}")
+                self._stop.wait(delay)
+                backoff = min(backoff * 2, 60)
+            except Exception as e:
+                # Anything else (a malformed update, a failed offset write) must not end polling
+                with self._lock:
+                    self._stats["errors"] += 1
+                logger.error(f"Polling failed, retrying in {backoff}s: {str(e)}", exc_info=True)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="update-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["offset"] = self.offset
+        return stats
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from storage import atomic_write
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/price_history.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = os.getenv('PRICE_HISTORY_PATH', os.path.join('data', 'price_history.npz'))
+HISTORY_SLOTS = 288       # 4h48m of one-minute ticks
+HISTORY_MAX_COINS = 1024
+MOMENTUM_WINDOWS = {"15m": 15 * 60, "1h": 60 * 60, "4h": 4 * 60 * 60}
+
+class PriceHistory:
+    """
+    Fixed-size ring buffer of price/volume snapshots for a set of coins.
+
+    All storage is preallocated: `slots` ticks by `max_coins` coins for price
+    and 24h volume, so memory never grows. A coin gets a column the first
+    time it is seen; coins beyond `max_coins` are ignored (and logged once each).
+    """
+    def __init__(self, slots: int = HISTORY_SLOTS, max_coins: int = HISTORY_MAX_COINS, path: Optional[str] = HISTORY_PATH):
+        self.slots = slots
+        self.max_coins = max_coins
+        self.path = path
+        self.times = np.full(slots, np.nan)
+        self.prices = np.full((slots, max_coins), np.nan)
+        self.volumes = np.full((slots, max_coins), np.nan)
+        self.columns = {}
+        self.untracked = set()  # coins turned away because the buffer is full
+        self.head = 0   # next slot to write
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _columns_for(self, ids: Iterable[str], assign: bool = False) -> np.ndarray:
+        cols = []
+        for coin in ids:
+            col = self.columns.get(coin)
+            if col is None and assign:
+                if len(self.columns) < self.max_coins:
+                    col = self.columns[coin] = len(self.columns)
+                elif coin not in self.untracked:
+                    self.untracked.add(coin)
+                    logger.warning(f"Price history full ({self.max_coins} coins), not tracking {coin}")
+            cols.append(-1 if col is None else col)
+        return np.asarray(cols, dtype=np.int64)
+
+    def append(self, ids, prices, volumes, timestamp: Optional[float] = None) -> bool:
+        """Record one tick. Ticks not newer than the last one are ignored."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if self.count and timestamp <= self.times[(self.head - 1) % self.slots]:
+                return False
+            cols = self._columns_for(ids, assign=True)
+            known = cols >= 0
+            self.times[self.head] = timestamp
+            self.prices[self.head].fill(np.nan)
+            self.volumes[self.head].fill(np.nan)
+            self.prices[self.head, cols[known]] = np.asarray(prices, dtype=np.float64)[known]
+            self.volumes[self.head, cols[known]] = np.asarray(volumes, dtype=np.float64)[known]
+            self.head = (self.head + 1) % self.slots
+            self.count = min(self.count + 1, self.slots)
+            return True
+
+    def _slot_at(self, timestamp: float) -> Optional[int]:
+        """Newest slot recorded at or before `timestamp`, or None if history doesn't reach back that far."""
+        oldest = (self.head - self.count) % self.slots
+        ordered = np.roll(self.times, -oldest)[:self.count]
+        i = np.searchsorted(ordered, timestamp, side='right') - 1
+        if i < 0:
+            return None
+        return (oldest + i) % self.slots
+
+    def momentum(self, ids, windows: Dict[str, float] = MOMENTUM_WINDOWS) -> Dict[str, np.ndarray]:
+        """
+        Percent price change and 24h-volume change over each window for `ids`,
+        as arrays aligned with `ids`. NaN where there's not enough history.
+        """
+        ids = list(ids)
+        result = {}
+        with self.lock:
+            cols = self._columns_for(ids)
+            known = cols >= 0
+            nan = np.full(len(ids), np.nan)
+            if not self.count:
+                for label in windows:
+                    result[f"change_{label}"] = nan.copy()
+                    result[f"volume_change_{label}"] = nan.copy()
+                return result
+
+            latest = (self.head - 1) % self.slots
+            now = self.times[latest]
+            price_now = np.where(known, self.prices[latest, cols], np.nan)
+            volume_now = np.where(known, self.volumes[latest, cols], np.nan)
+
+            for label, seconds in windows.items():
+                slot = self._slot_at(now - seconds)
+                if slot is None:
+                    result[f"change_{label}"] = nan.copy()
+                    result[f"volume_change_{label}"] = nan.copy()
+                    continue
+                price_then = np.where(known, self.prices[slot, cols], np.nan)
+                volume_then = np.where(known, self.volumes[slot, cols], np.nan)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    result[f"change_{label}"] = (price_now / price_then - 1) * 100
+                    result[f"volume_change_{label}"] = (volume_now / volume_then - 1) * 100
+        return result
+
+    def save(self) -> None:
+        """Persist the buffers atomically (temp file + rename)."""
+        if not self.path:
+            return
+        with self.lock:
+            state = {
+                "times": self.times.copy(),
+                "prices": self.prices.copy(),
+                "volumes": self.volumes.copy(),
+                "ids": np.array(sorted(self.columns, key=self.columns.get), dtype=str),
+                "cursor": np.array([self.head, self.count])
+            }
+        with atomic_write(self.path, 'wb') as f:
+            np.savez(f, **state)
+
+    @classmethod
+    def load(cls, path: str = HISTORY_PATH, slots: int = HISTORY_SLOTS, max_coins: int = HISTORY_MAX_COINS) -> "PriceHistory":
+        """Restore persisted buffers, or start empty if there are none or their shape no longer matches."""
+        history = cls(slots, max_coins, path)
+        try:
+            with np.load(path) as state:
+                if state["prices"].shape != (slots, max_coins):
+                    logger.warning(f"Discarding price history at {path}: shape {state['prices'].shape} != {(slots, max_coins)}")
+                    return history
+                history.times[:] = state["times"]
+                history.prices[:] = state["prices"]
+                history.volumes[:] = state["volumes"]
+                history.columns = {coin: i for i, coin in enumerate(state["ids"].tolist())}
+                history.head, history.count = (int(x) for x in state["cursor"])
+            logger.info(f"Loaded price history: {history.count} ticks for {len(history.columns)} coins")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Could not load price history from {path}: {str(e)}")
+            return cls(slots, max_coins, path)
+        return history
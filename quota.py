@@ -0,0 +1,184 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/quota.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower is served first
+PRIORITY_SCHEDULED = 0    # Scheduled drops
+PRIORITY_INTERACTIVE = 1  # User commands (the default)
+PRIORITY_BACKGROUND = 2   # Cache refreshes and other speculative work
+
+# Default per-upstream limits, each overridable with QUOTA_<NAME>_RPM / _BURST / _TPM
+UPSTREAM_LIMITS = {
+    "coingecko": {"rpm": 30, "burst": 30},  # Free tier: 30 calls/min, no spacing required
+    "polygon": {"rpm": 5, "burst": 5},
+    "newsapi": {"rpm": 30, "burst": 5},
+    "openai": {"rpm": 60, "burst": 10, "tpm": 10000},
+    "telegram": {"rpm": 1800, "burst": 30}
+}
+
+_priority = contextvars.ContextVar("quota_priority", default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed block (and anything it submits with copied context) at `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> int:
+    return _priority.get()
+
+def submit(executor, func, *args, **kwargs):
+    """executor.submit that carries the caller's priority (and other context) into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        missing = min(cost, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0) if self.rate > 0 else float('inf')
+
+    def take(self, cost: float) -> None:
+        self.tokens -= min(cost, self.capacity)
+
+class Quota:
+    """
+    Request (and optionally token) budget for one upstream.
+
+    Waiters are admitted strictly in (priority, arrival) order, so a steady
+    stream of small requests can't starve an earlier or more important one.
+    """
+    def __init__(self, name: str, rpm: float, burst: Optional[float] = None, tpm: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(rpm, burst or rpm)
+        self.tokens = TokenBucket(tpm, tpm) if tpm else None
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._stats = {"granted": 0, "timeouts": 0, "waited": 0, "wait_seconds": 0.0}
+
+    def acquire(self, tokens: float = 0, level: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Block until one request (plus `tokens` model tokens) fits the budget. False on timeout."""
+        level = current_priority() if level is None else level
+        ticket = (level, next(self._seq))
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    if self.tokens:
+                        self.tokens.refill(now)
+
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        wait = self.requests.wait_time(1)
+                        if self.tokens and tokens:
+                            wait = max(wait, self.tokens.wait_time(tokens))
+                        if wait == 0:
+                            self.requests.take(1)
+                            if self.tokens and tokens:
+                                self.tokens.take(tokens)
+                            self._record(now - start)
+                            return True
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self._stats["timeouts"] += 1
+                            logger.warning(f"{self.name} quota wait timed out after {timeout}s")
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(None if wait == float('inf') else wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    async def acquire_async(self, tokens: float = 0, level: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Awaitable acquire; the wait happens off the event loop and keeps its place in the queue."""
+        level = current_priority() if level is None else level
+        return await asyncio.to_thread(self.acquire, tokens, level, timeout)
+
+    def settle(self, estimated: float, actual: float) -> None:
+        """Correct the token bucket once the real usage of a request is known."""
+        if not self.tokens:
+            return
+        with self._cond:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + estimated - actual)
+            self._cond.notify_all()
+
+    def _record(self, waited: float) -> None:
+        self._stats["granted"] += 1
+        if waited > 0.001:
+            self._stats["waited"] += 1
+            self._stats["wait_seconds"] += waited
+            logger.info(f"{self.name} quota admitted after {waited:.2f}s")
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._waiters)
+            stats["requests_available"] = round(self.requests.tokens, 2)
+            if self.tokens:
+                stats["tokens_available"] = round(self.tokens.tokens)
+            return stats
+
+class QuotaManager:
+    """Registry of per-upstream quotas."""
+    def __init__(self, limits: Dict[str, Dict] = UPSTREAM_LIMITS):
+        self.quotas = {}
+        for name, limit in limits.items():
+            prefix = f"QUOTA_{name.upper()}_"
+            rpm = float(os.getenv(prefix + "RPM", limit["rpm"]))
+            burst = float(os.getenv(prefix + "BURST", limit.get("burst", rpm)))
+            tpm = os.getenv(prefix + "TPM", limit.get("tpm"))
+            self.quotas[name] = Quota(name, rpm, burst, float(tpm) if tpm else None)
+
+    def __getitem__(self, name: str) -> Quota:
+        return self.quotas[name]
+
+    def stats(self) -> Dict:
+        return {name: quota.stats() for name, quota in self.quotas.items()}
+
+quota_manager = QuotaManager()
+
+def acquire(upstream: str, tokens: float = 0, level: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+    """Wait for budget on `upstream` at the caller's priority."""
+    return quota_manager[upstream].acquire(tokens, level, timeout)
+
+async def acquire_async(upstream: str, tokens: float = 0, level: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+    return await quota_manager[upstream].acquire_async(tokens, level, timeout)
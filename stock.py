@@ -1,12 +1,22 @@
 import requests
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
 import numpy as np
 import openai
 import os
-import tempfile
+import io
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 
+from candles import CandleStore, Candles
+from indicators import batch_indicators, batch_rsi, rolling_mean, BOLLINGER_PERIOD
+from llm import cached_completion
+import quota
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +37,7 @@ def fetch_polygon_price(symbol, polygon_api_key=POLYGON_API_KEY):
             return None
             
         url = f"https://api.polygon.io/v2/last/trade/{symbol.upper()}?apiKey={polygon_api_key}"
+        quota.acquire("polygon")
         resp = requests.get(url, timeout=10)
         resp.raise_for_status()
         
@@ -46,116 +57,113 @@ def fetch_polygon_price(symbol, polygon_api_key=POLYGON_API_KEY):
         logger.error(f"Unexpected error fetching price for {symbol}: {str(e)}")
         return None
 
+# ---- Local Candle Cache ----
+# Daily bars live in the CandleStore; after the first full download only bars
+# from the last stored timestamp onward are requested from Polygon.
+OHLC_MULTIPLIER = 1
+OHLC_TIMESPAN = "day"
+OHLC_TIMEFRAME = f"{OHLC_MULTIPLIER}{OHLC_TIMESPAN}"
+OHLC_HISTORY_DAYS = 90  # Initial backfill for a symbol with no stored bars
+OHLC_REFRESH_SECONDS = int(os.getenv('OHLC_REFRESH_SECONDS', 300))
+ANALYSIS_CACHE_TTL = 3600  # Same daily-bar inputs give the same analysis; reuse it for an hour
+
+candle_store = CandleStore()
+_last_sync = {}
+
+def fetch_polygon_aggs(symbol, start_ms, end_ms, polygon_api_key=POLYGON_API_KEY):
+    """Fetch aggregate bars between two epoch-ms timestamps, oldest first, following pagination."""
+    url = (
+        f"https://api.polygon.io/v2/aggs/ticker/{symbol.upper()}/range/{OHLC_MULTIPLIER}/{OHLC_TIMESPAN}/"
+        f"{start_ms}/{end_ms}?adjusted=true&sort=asc&limit=50000"
+    )
+    bars = []
+    while url:
+        quota.acquire("polygon")
+        resp = requests.get(url, params={'apiKey': polygon_api_key}, timeout=10)
+        resp.raise_for_status()
+
+        data = resp.json()
+        if data.get('status') == 'ERROR':
+            raise Exception(data.get('error', 'Unknown error'))
+        bars.extend(data.get('results', []))
+        url = data.get('next_url')
+    return bars
+
+def sync_polygon_ohlc(symbol, polygon_api_key=POLYGON_API_KEY):
+    """Bring the stored candles for `symbol` up to date with a delta fetch."""
+    key = symbol.upper()
+    now = time.time()
+    if now - _last_sync.get(key, 0) < OHLC_REFRESH_SECONDS:
+        return
+
+    last_t = candle_store.last_timestamp(symbol, OHLC_TIMEFRAME)
+    if last_t is None:
+        start_ms = int((datetime.now() - timedelta(days=OHLC_HISTORY_DAYS)).timestamp() * 1000)
+    else:
+        # Re-request the newest stored bar, it may have still been forming
+        start_ms = last_t
+    end_ms = int(now * 1000)
+
+    bars = fetch_polygon_aggs(symbol, start_ms, end_ms, polygon_api_key)
+    candle_store.merge(symbol, OHLC_TIMEFRAME, bars)
+    _last_sync[key] = now
+    logger.info(f"Synced {symbol} candles: {len(bars)} bars fetched since {start_ms}")
+
 def fetch_polygon_ohlc(symbol, polygon_api_key=POLYGON_API_KEY, limit=30):
     try:
         if not polygon_api_key:
             logger.error("Polygon API key not configured")
-            return []
-            
-        # Calculate date range dynamically
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=90)  # Get 90 days of data
-        
-        url = (
-            f"https://api.polygon.io/v2/aggs/ticker/{symbol.upper()}/range/1/day/"
-            f"{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
-            f"?adjusted=true&sort=desc&limit={limit}&apiKey={polygon_api_key}"
-        )
-        
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        
-        data = resp.json()
-        if 'results' in data:
-            candles = data['results'][::-1]  # oldest to newest
-            logger.info(f"Fetched {len(candles)} candles for {symbol}")
-            return candles
-        else:
-            logger.error(f"Polygon OHLC API error: {data.get('error', 'Unknown error')}")
-            return []
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error fetching OHLC for {symbol}: {str(e)}")
-        return []
+            return Candles()
+
+        try:
+            sync_polygon_ohlc(symbol, polygon_api_key)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Request error fetching OHLC for {symbol}, using stored candles: {str(e)}")
+        except Exception as e:
+            logger.error(f"Polygon OHLC API error for {symbol}, using stored candles: {str(e)}")
+
+        candles = candle_store.candles(symbol, OHLC_TIMEFRAME, limit)
+        logger.info(f"Loaded {len(candles)} candles for {symbol}")
+        return candles
+
     except Exception as e:
         logger.error(f"Unexpected error fetching OHLC for {symbol}: {str(e)}")
-        return []
+        return Candles()
 
 def calc_rsi(closes, period=14):
     try:
-        closes = np.array(closes)
-        deltas = np.diff(closes)
-        
-        if len(deltas) < period:
-            logger.error(f"Not enough data points for RSI calculation. Need {period}, got {len(deltas)}")
+        closes = np.asarray(closes, dtype=np.float64)
+        if len(closes) - 1 < period:
+            logger.error(f"Not enough data points for RSI calculation. Need {period}, got {max(len(closes) - 1, 0)}")
             return np.zeros_like(closes)
-            
-        seed = deltas[:period]
-        up = seed[seed >= 0].sum() / period
-        down = -seed[seed < 0].sum() / period
-        rs = up / down if down != 0 else float('inf')
-        
-        rsi = np.zeros_like(closes)
-        rsi[:period] = 100. - 100. / (1. + rs)
-        
-        for i in range(period, len(closes)):
-            delta = deltas[i - 1]
-            if delta > 0:
-                upval = delta
-                downval = 0.
-            else:
-                upval = 0.
-                downval = -delta
-                
-            up = (up * (period - 1) + upval) / period
-            down = (down * (period - 1) + downval) / period
-            rs = up / down if down != 0 else float('inf')
-            rsi[i] = 100. - 100. / (1. + rs)
-            
-        return rsi
-        
+        return batch_rsi(closes, period)[0]
+
     except Exception as e:
         logger.error(f"Error calculating RSI: {str(e)}")
         return np.zeros_like(closes)
 
-def calculate_technical_indicators(hist):
-    """Calculate additional technical indicators."""
+def _scalar(value, default=None):
+    """Plain float from a batch result, or `default` where the window didn't fit."""
+    value = float(value)
+    return default if np.isnan(value) else value
+
+def calculate_technical_indicators(hist, indicators=None):
+    """Calculate additional technical indicators, reusing `batch_indicators` output if given."""
     try:
-        closes = np.array(hist.close)
-        volumes = np.array(hist.volumes)
-        
-        # Calculate moving averages
-        ma20 = np.convolve(closes, np.ones(20)/20, mode='valid')
-        ma50 = np.convolve(closes, np.ones(50)/50, mode='valid')
-        
-        # Calculate volume SMA
-        vol_sma = np.convolve(volumes, np.ones(20)/20, mode='valid')
-        
-        # Calculate Bollinger Bands
-        period = 20
-        std = np.std(closes[-period:])
-        middle_band = ma20[-1]
-        upper_band = middle_band + (std * 2)
-        lower_band = middle_band - (std * 2)
-        
-        # Current price position
-        current_price = closes[-1]
-        price_vs_ma20 = (current_price / ma20[-1] - 1) * 100 if len(ma20) > 0 else 0
-        price_vs_ma50 = (current_price / ma50[-1] - 1) * 100 if len(ma50) > 0 else 0
-        
-        # Volume analysis
-        avg_volume = np.mean(volumes[-20:])
-        current_volume = volumes[-1]
-        volume_ratio = current_volume / avg_volume
-        
+        if len(hist.close) < BOLLINGER_PERIOD:
+            logger.error(f"Not enough data points for technical indicators. Need {BOLLINGER_PERIOD}, got {len(hist.close)}")
+            return {}
+        if indicators is None:
+            indicators = batch_indicators(hist.close, hist.volumes)
+
         return {
-            'ma20': ma20[-1] if len(ma20) > 0 else None,
-            'ma50': ma50[-1] if len(ma50) > 0 else None,
-            'upper_band': upper_band,
-            'lower_band': lower_band,
-            'price_vs_ma20': price_vs_ma20,
-            'price_vs_ma50': price_vs_ma50,
-            'volume_ratio': volume_ratio
+            'ma20': _scalar(indicators['ma20'][0]),
+            'ma50': _scalar(indicators['ma50'][0]),
+            'upper_band': float(indicators['upper_band'][0]),
+            'lower_band': float(indicators['lower_band'][0]),
+            'price_vs_ma20': _scalar(indicators['price_vs_ma20'][0], 0),
+            'price_vs_ma50': _scalar(indicators['price_vs_ma50'][0], 0),
+            'volume_ratio': float(indicators['volume_ratio'][0])
         }
         
     except Exception as e:
@@ -166,32 +174,19 @@ def fetch_stock_data(symbol):
     try:
         logger.info(f"Fetching stock data for {symbol}")
         
-        candles = fetch_polygon_ohlc(symbol)
-        if not candles or len(candles) < 15:
+        hist = fetch_polygon_ohlc(symbol)
+        if len(hist) < 15:
             logger.error(f"Not enough candle data for {symbol}")
             return None, None
-            
-        closes = [c['c'] for c in candles]
-        volumes = [c['v'] for c in candles]
-        
-        rsi = calc_rsi(closes)
-        
-        class History:
-            pass
-            
-        hist = History()
-        hist.index = [c['t'] for c in candles]  # Timestamps (ms)
-        hist.close = closes
-        hist.rsi = rsi
-        hist.volumes = volumes
-        hist._candles = candles
-        
-        # Calculate additional technical indicators
-        tech_indicators = calculate_technical_indicators(hist)
-        
+
+        # RSI and the other indicators in one pass over the candles
+        indicators = batch_indicators(hist.close, hist.volumes)
+        hist.rsi = indicators['rsi'][0]
+        tech_indicators = calculate_technical_indicators(hist, indicators)
+
         info = {
-            "regularMarketPrice": closes[-1],
-            "volume": volumes[-1],
+            "regularMarketPrice": float(hist.close[-1]),
+            "volume": float(hist.volumes[-1]),
             "technical_indicators": tech_indicators
         }
         
@@ -202,69 +197,122 @@ def fetch_stock_data(symbol):
         logger.error(f"Error in fetch_stock_data for {symbol}: {str(e)}")
         return None, None
 
-def generate_chart(symbol, hist):
-    try:
-        logger.info(f"Generating chart for {symbol}")
-        
-        timestamps = [datetime.fromtimestamp(t/1000) for t in hist.index]
-        
-        # Create figure with subplots
-        fig = plt.figure(figsize=(12, 8))
-        gs = plt.GridSpec(3, 1, height_ratios=[2, 1, 1])
-        
+class ChartRenderer:
+    """
+    Renders technical-analysis charts with the object-oriented Agg backend.
+
+    Pre-built figure/axes templates are kept in a small shared pool, checked
+    out for one render at a time and cleared and redrawn, so they survive the
+    short-lived threads each drop pipeline runs on. The PNG is encoded to
+    memory at a size Telegram serves without downscaling.
+
+    Everything `cla()` doesn't reset (subplot spacing, date ticks) is set
+    again on each render, and the PNG carries no metadata, so the same
+    candles give the same bytes whichever template draws them.
+    """
+    FIGSIZE = (12, 8)
+    DPI = 106  # ~1280x850px; Telegram downscales larger photos to 1280px anyway
+    MAX_TEMPLATES = 2  # concurrent renders beyond this build a throwaway figure
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates = []
+        self.built = 0
+
+    def _checkout(self):
+        with self._lock:
+            if self._templates:
+                return self._templates.pop()
+            self.built += 1
+        fig = Figure(figsize=self.FIGSIZE, dpi=self.DPI)
+        FigureCanvasAgg(fig)
+        gs = fig.add_gridspec(3, 1, height_ratios=[2, 1, 1])
+        axes = (fig.add_subplot(gs[0]), fig.add_subplot(gs[1]), fig.add_subplot(gs[2]))
+        return fig, axes
+
+    def _checkin(self, template):
+        with self._lock:
+            if len(self._templates) < self.MAX_TEMPLATES:
+                self._templates.append(template)
+
+    def render(self, symbol, hist):
+        """Draw the chart for `hist` and return it as PNG bytes."""
+        template = self._checkout()
+        try:
+            return self._draw(template, symbol, hist)
+        finally:
+            self._checkin(template)
+
+    def _draw(self, template, symbol, hist):
+        fig, (ax1, ax2, ax3) = template
+        for ax in (ax1, ax2, ax3):
+            ax.cla()
+        # tight_layout starts from the current spacing, so undo the last render's
+        fig.subplots_adjust(**{k: matplotlib.rcParams[f'figure.subplot.{k}'] for k in ('left', 'right', 'top', 'bottom', 'hspace')})
+
+        timestamps = hist.index.astype('datetime64[ms]')
+
         # Price and MA subplot
-        ax1 = fig.add_subplot(gs[0])
         ax1.plot(timestamps, hist.close, label="Price", color='blue')
-        
+
         # Add moving averages if available
-        closes = np.array(hist.close)
+        closes = hist.close
         if len(closes) >= 20:
-            ma20 = np.convolve(closes, np.ones(20)/20, mode='valid')
-            ma50 = np.convolve(closes, np.ones(50)/50, mode='valid')
+            ma20 = rolling_mean(closes, 20)[0]
+            ma50 = rolling_mean(closes, 50)[0]
             ax1.plot(timestamps[-len(ma20):], ma20, label="MA20", color='orange', linestyle='--')
             if len(ma50) > 0:
                 ax1.plot(timestamps[-len(ma50):], ma50, label="MA50", color='red', linestyle='--')
-        
+
         ax1.set_title(f"{symbol} - Technical Analysis")
         ax1.legend()
         ax1.grid(True)
-        
+
         # Volume subplot
-        ax2 = fig.add_subplot(gs[1])
         ax2.bar(timestamps, hist.volumes, label="Volume", color='gray', alpha=0.5)
         ax2.legend()
         ax2.grid(True)
-        
+
         # RSI subplot
-        ax3 = fig.add_subplot(gs[2])
         ax3.plot(timestamps, hist.rsi, label="RSI", color='purple')
         ax3.axhline(70, color='red', linestyle='--')
         ax3.axhline(30, color='green', linestyle='--')
         ax3.legend()
         ax3.grid(True)
-        
-        plt.tight_layout()
-        
-        # Create charts directory if it doesn't exist
-        charts_dir = os.path.join(os.getcwd(), 'charts')
-        os.makedirs(charts_dir, exist_ok=True)
-        
-        # Save chart
-        filename = os.path.join(charts_dir, f"{symbol}_chart.png")
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        if not os.path.exists(filename):
-            raise Exception(f"Failed to save chart to {filename}")
-            
-        logger.info(f"Successfully generated chart for {symbol}")
-        return filename
-        
+
+        # A fresh locator per render; ConciseDateFormatter drops the repeated year/month
+        for ax in (ax1, ax2, ax3):
+            locator = AutoDateLocator()
+            ax.xaxis.set_major_locator(locator)
+            ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+
+        fig.tight_layout()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', metadata={'Software': None})
+        return buf.getvalue()
+
+chart_renderer = ChartRenderer()
+
+def generate_chart(symbol, hist):
+    """Render the chart for `symbol` and return the PNG bytes, or None on failure."""
+    try:
+        logger.info(f"Generating chart for {symbol}")
+        png = chart_renderer.render(symbol, hist)
+        logger.info(f"Successfully generated chart for {symbol} ({len(png) / 1024:.0f}KB)")
+        return png
+
     except Exception as e:
         logger.error(f"Error generating chart for {symbol}: {str(e)}", exc_info=True)
         return None
 
 # === GPT-Powered Analysis as Nova Stratos ===
+def _format_ma(tech, key):
+    """'$12.34 (5.6% from price)', or 'n/a' when there weren't enough bars for the average."""
+    if tech.get(key) is None:
+        return "n/a"
+    return f"${tech[key]:.2f} ({tech.get(f'price_vs_{key}', 0):.1f}% from price)"
+
 def ask_chatgpt(symbol, info, hist, openai_api_key):
     try:
         if not openai_api_key:
@@ -280,8 +328,8 @@ def ask_chatgpt(symbol, info, hist, openai_api_key):
 Current Price: ${info['regularMarketPrice']:.2f}
 RSI (14): {rsi_val:.2f}
 Volume: {info['volume']:,} (x{tech.get('volume_ratio', 0):.2f} avg)
-MA20: ${tech.get('ma20', 0):.2f} ({tech.get('price_vs_ma20', 0):.1f}% from price)
-MA50: ${tech.get('ma50', 0):.2f} ({tech.get('price_vs_ma50', 0):.1f}% from price)
+MA20: {_format_ma(tech, 'ma20')}
+MA50: {_format_ma(tech, 'ma50')}
 Bollinger Bands:
 - Upper: ${tech.get('upper_band', 0):.2f}
 - Lower: ${tech.get('lower_band', 0):.2f}
@@ -305,7 +353,8 @@ Symbol: {symbol}
 """
 
         logger.info(f"Requesting analysis for {symbol}")
-        response = openai.chat.completions.create(
+        analysis = cached_completion(
+            ANALYSIS_CACHE_TTL,
             model="gpt-4",
             messages=[
                 {"role": "system", "content": "You are Nova Stratos, an AI quant analyst specializing in technical analysis and breakout detection."},
@@ -315,12 +364,12 @@ Symbol: {symbol}
             max_tokens=750
         )
         
-        if not response.choices:
+        if analysis is None:
             logger.error("No response from OpenAI API")
             return "Error: Could not generate analysis"
             
         logger.info(f"Successfully generated analysis for {symbol}")
-        return response.choices[0].message.content
+        return analysis
 
     except openai.error.AuthenticationError:
         logger.error("OpenAI API authentication failed")
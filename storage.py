@@ -0,0 +1,23 @@
+import os
+import threading
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w'):
+    """
+    Open a temp file next to `path` for writing and swap it in with os.replace
+    when the block exits cleanly, so readers only ever see the old or the new
+    file. The temp name is unique per process and thread; on error it is removed.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
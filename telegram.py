@@ -2,30 +2,14 @@ import openai
 import requests
 import os
 import random
-from jokes import nova_joke
+from jokes import nova_joke, random_comedian_joke
+from broadcast import send_with_retry, TelegramAPIError
+import quota
 
 NEWS_API_KEY = os.getenv("NEWS_API_KEY")
 
 
 
-# ---- Nova's Real-Time Comedian Joke ----
-def random_comedian_joke(openai_api_key, topic="trading, crypto, meme coins, or financial markets"):
-    openai.api_key = openai_api_key
-    comedian = random.choice(COMEDIANS)
-    prompt = (
-        f"Act as {comedian}, the legendary stand-up comedian. "
-        f"Make a brand new, sharp, clever joke about {topic} as if you're performing live. "
-        f"Channel the exact comedic style, voice, and attitude of {comedian}. "
-        f"Don't recycle classic bits; make it original and relevant to modern trading, markets, or crypto culture. "
-        f"Deliver it as a one-liner or a short bit, and sign off with '- {comedian}'."
-    )
-    response = openai.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return response.choices[0].message.content
-
-
 # ---- Get Latest Finance News ----
 def get_finance_news():
     try:
@@ -34,6 +18,7 @@ def get_finance_news():
             return "📰 News service not configured"
 
         url = f"https://newsapi.org/v2/top-headlines?category=business&language=en&apiKey={NEWS_API_KEY}"
+        quota.acquire("newsapi")
         resp = requests.get(url, timeout=10)
         resp.raise_for_status()  # Will raise an exception for 4XX/5XX status codes
         
@@ -73,8 +58,7 @@ def handle_telegram_command(command, openai_api_key, keyword_found=None):
         return "Unknown command. Try /drop, /memesnipe, /joke, or /news."
 
 # ---- Send Welcome DM ----
-def send_welcome_dm(username, bot_token):
-    msg = """🚀 You're in.
+WELCOME_MESSAGE = """🚀 You're in.
 
 Welcome to *DAILY ALPHA* — my private signal channel.
 
@@ -86,6 +70,19 @@ Link is yours — don't share it.
 Next move hits soon.
 
 – @MrOrangeUS"""
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {'chat_id': f"@{username}", 'text': msg, 'parse_mode': 'Markdown'}
-    requests.post(url, data=payload)
+
+def send_welcome_dm(chat_id, bot_token):
+    """
+    Send the welcome message. `chat_id` must be numeric for a private user;
+    "@name" only reaches public chats. Returns False if Telegram refused it
+    for good (unknown chat, bot blocked); transient failures are raised.
+    """
+    payload = {'chat_id': chat_id, 'text': WELCOME_MESSAGE, 'parse_mode': 'Markdown'}
+    try:
+        send_with_retry(bot_token, "sendMessage", payload)
+        return True
+    except TelegramAPIError as e:
+        if not e.permanent:
+            raise
+        print(f"Welcome DM to {chat_id} refused: {e.description}")
+        return False
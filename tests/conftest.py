@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules open logs/ and their default data/ stores relative to the working
+# directory at import time; keep both out of the checkout.
+WORKDIR = tempfile.mkdtemp(prefix="nova-tests-")
+os.makedirs(os.path.join(WORKDIR, "logs"))
+os.chdir(WORKDIR)
+
+# app.py refuses to import without these
+for var in ("TELEGRAM_BOT_TOKEN", "TELEGRAM_CHAT_ID", "OPENAI_API_KEY", "POLYGON_API_KEY", "NEWS_API_KEY"):
+    os.environ.setdefault(var, "test")
@@ -0,0 +1,62 @@
+import pytest
+
+from alerts import AlertBook, AlertError, parse_alert_command
+
+def make_book(tmp_path):
+    return AlertBook(str(tmp_path / "alerts.json"))
+
+def test_parse_alert_command():
+    assert parse_alert_command("/alert pepe > 0.000012") == ("pepe", "price", ">", 0.000012)
+    assert parse_alert_command("/alert XFOR rsi<30") == ("XFOR", "rsi", "<", 30.0)
+    with pytest.raises(AlertError):
+        parse_alert_command("/alert pepe")
+
+def test_above_fires_once_when_crossed(tmp_path):
+    book = make_book(tmp_path)
+    alert = book.add(1, "pepe", "coin", "price", ">", 5.0)
+    assert book.update("pepe", "price", 4.0) == []
+    assert book.update("pepe", "price", 4.9) == []
+    assert [a["id"] for a in book.update("pepe", "price", 5.0)] == [alert["id"]]
+    assert book.update("pepe", "price", 6.0) == []
+    assert book.for_chat(1) == []
+
+def test_below_fires_when_crossed(tmp_path):
+    book = make_book(tmp_path)
+    alert = book.add(1, "XFOR", "stock", "rsi", "<", 30.0)
+    assert book.update("XFOR", "rsi", 45.0) == []
+    assert [a["id"] for a in book.update("XFOR", "rsi", 29.5)] == [alert["id"]]
+
+def test_move_only_fires_thresholds_in_between(tmp_path):
+    book = make_book(tmp_path)
+    low = book.add(1, "pepe", "coin", "price", ">", 2.0)
+    mid = book.add(2, "pepe", "coin", "price", ">", 3.0)
+    high = book.add(3, "pepe", "coin", "price", ">", 10.0)
+    book.update("pepe", "price", 1.0)
+    fired = book.update("pepe", "price", 3.5)
+    assert {a["id"] for a in fired} == {low["id"], mid["id"]}
+    assert [a["id"] for a in book.for_chat(3)] == [high["id"]]
+
+def test_first_value_fires_alerts_already_past(tmp_path):
+    # After a restart there's no previous value: anything already past its threshold fires
+    book = make_book(tmp_path)
+    above = book.add(1, "pepe", "coin", "price", ">", 5.0)
+    below = book.add(2, "pepe", "coin", "price", "<", 6.0)
+    book.add(3, "pepe", "coin", "price", ">", 7.0)
+    fired = book.update("pepe", "price", 5.5)
+    assert {a["id"] for a in fired} == {above["id"], below["id"]}
+
+def test_symbols_and_metrics_are_tracked(tmp_path):
+    book = make_book(tmp_path)
+    alert = book.add(1, "XFOR", "stock", "rsi", "<", 30.0)
+    book.add(1, "XFOR", "stock", "price", ">", 10.0)
+    assert book.symbols("stock") == {"XFOR": {"rsi", "price"}}
+    assert book.remove(alert["id"], 2) is False  # someone else's alert
+    assert book.remove(alert["id"], 1) is True
+    assert book.symbols("stock") == {"XFOR": {"price"}}
+
+def test_alerts_survive_reload(tmp_path):
+    book = make_book(tmp_path)
+    alert = book.add(1, "pepe", "coin", "price", ">", 5.0)
+    reloaded = AlertBook.load(str(tmp_path / "alerts.json"))
+    assert [a["id"] for a in reloaded.for_chat(1)] == [alert["id"]]
+    assert [a["id"] for a in reloaded.update("pepe", "price", 6.0)] == [alert["id"]]
@@ -0,0 +1,50 @@
+import pytest
+
+import app
+from alerts import AlertBook
+from memecoin import MarketSnapshot
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [6000.0]  # the start of a 60s window
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    return now
+
+def test_rate_limit_per_key(clock):
+    limiter = app.RateLimit(max_requests=3, window=60)
+    assert [limiter.is_allowed("a") for _ in range(4)] == [True, True, True, False]
+    assert limiter.is_allowed("b")
+
+def test_rate_limit_slides_across_windows(clock):
+    limiter = app.RateLimit(max_requests=4, window=60)
+    for _ in range(4):
+        assert limiter.is_allowed("a")
+    # Halfway into the next window half of the previous window still counts
+    clock[0] += 90
+    assert [limiter.is_allowed("a") for _ in range(3)] == [True, True, False]
+    # A window later the old counts are gone
+    clock[0] += 120
+    assert all(limiter.is_allowed("a") for _ in range(4))
+
+def test_rate_limit_drops_least_recent_keys(clock):
+    limiter = app.RateLimit(max_requests=1, window=60, max_keys=2)
+    limiter.is_allowed("a")
+    limiter.is_allowed("b")
+    limiter.is_allowed("a")
+    limiter.is_allowed("c")
+    assert list(limiter.requests) == ["a", "c"]
+
+def test_create_alert_fires_alerts_it_crosses(tmp_path, monkeypatch):
+    book = AlertBook(str(tmp_path / "alerts.json"))
+    sent = []
+    monkeypatch.setattr(app, "alert_book", book)
+    monkeypatch.setattr(app, "notify_alert", lambda chat_id, text: sent.append(chat_id))
+    monkeypatch.setattr(app, "fetch_market_snapshot", lambda: MarketSnapshot(["pepe"], [5.5], [0], [0], [0]))
+
+    existing = book.add(1, "pepe", "coin", "price", ">", 5.0)
+    reply = app.create_alert("/alert pepe > 6", 2)
+
+    assert reply.startswith("🔔 Alert set")
+    assert sent == [1]
+    assert existing["id"] not in book.alerts
+    assert [a["chat_id"] for a in book.for_chat(2)] == [2]
@@ -0,0 +1,58 @@
+from dedupe import SeenUpdates
+
+def test_handled_update_is_a_duplicate(tmp_path):
+    seen = SeenUpdates(str(tmp_path / "seen.log"))
+    assert seen.begin(1)
+    assert not seen.begin(1)  # redelivered while still being handled
+    seen.finish(1)
+    assert not seen.begin(1)
+    assert 1 in seen
+    assert seen.stats() == {"tracked": 1, "in_progress": 0, "duplicates": 2}
+
+def test_failed_update_can_be_retried(tmp_path):
+    seen = SeenUpdates(str(tmp_path / "seen.log"))
+    assert seen.begin(1)
+    seen.finish(1, handled=False)
+    assert 1 not in seen
+    assert seen.begin(1)
+
+def test_seen_updates_survive_restart(tmp_path):
+    path = str(tmp_path / "seen.log")
+    seen = SeenUpdates(path)
+    for update_id in (1, 2):
+        seen.begin(update_id)
+    seen.finish(1)
+    seen.finish(2, handled=False)
+    reloaded = SeenUpdates(path)
+    assert 1 in reloaded
+    assert 2 not in reloaded
+
+def test_window_is_bounded_and_log_compacted(tmp_path):
+    path = tmp_path / "seen.log"
+    seen = SeenUpdates(str(path), max_size=3)
+    for update_id in range(10):
+        seen.begin(update_id)
+        seen.finish(update_id)
+    assert list(seen.seen) == [7, 8, 9]
+    # The log is rewritten with the live window once it reaches 2 * max_size lines
+    assert len(path.read_text().splitlines()) < 2 * 3 + 1
+    assert list(SeenUpdates(str(path), max_size=3).seen) == [7, 8, 9]
+
+def test_old_updates_expire(tmp_path):
+    seen = SeenUpdates(str(tmp_path / "seen.log"), max_age=60)
+    seen.begin(1)
+    seen.finish(1)
+    seen.seen[1] -= 120
+    seen.begin(2)
+    seen.finish(2)
+    assert 1 not in seen
+    assert seen.begin(1)
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = tmp_path / "seen.log"
+    seen = SeenUpdates(str(path))
+    seen.begin(1)
+    seen.finish(1)
+    with open(path, "a") as f:
+        f.write("2")
+    assert list(SeenUpdates(str(path)).seen) == [1]
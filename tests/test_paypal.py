@@ -0,0 +1,103 @@
+import hashlib
+import time
+
+import pytest
+
+import paypal
+from paypal import IPNOutbox, ProcessedPayments
+
+# Stored payment hashes are SHA-256 hex digests
+ABC = hashlib.sha256(b"abc").hexdigest()
+OLD = hashlib.sha256(b"old").hexdigest()
+NEW = hashlib.sha256(b"new").hexdigest()
+
+@pytest.fixture
+def payments(tmp_path):
+    store = ProcessedPayments(str(tmp_path / "payments.db"))
+    yield store
+    store.db.close()
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = IPNOutbox(str(tmp_path / "payments.db"))
+    yield box
+    box.db.close()
+
+def test_claim_is_exclusive(payments):
+    assert ABC not in payments
+    assert payments.claim(ABC)
+    assert not payments.claim(ABC)
+    assert ABC in payments
+
+def test_claim_is_shared_between_processes(payments, tmp_path):
+    other = ProcessedPayments(str(tmp_path / "payments.db"))
+    try:
+        assert payments.claim(ABC)
+        assert not other.claim(ABC)
+        assert ABC in other  # not in other's Bloom filter yet, found in SQLite
+    finally:
+        other.db.close()
+
+def test_release_allows_a_retry(payments):
+    assert payments.claim(ABC)
+    payments.release(ABC)
+    assert ABC not in payments
+    assert payments.claim(ABC)
+
+def test_cleanup_expires_only_old_entries(payments):
+    payments.claim(OLD)
+    payments.claim(NEW)
+    payments.db.execute("UPDATE processed_payments SET processed_at = ? WHERE payment_hash = ?", (time.time() - 3 * 3600, OLD))
+    assert payments.cleanup_old_entries(max_age_hours=1) == 1
+    assert OLD not in payments
+    assert NEW in payments
+    assert payments.claim(OLD)
+
+def queued(outbox):
+    return outbox.db.execute("SELECT id, status, attempts, next_attempt_at FROM ipn_outbox ORDER BY id").fetchall()
+
+def test_drain_finishes_rejects_and_retries(outbox):
+    statuses = {"ok": ("OK", 200), "bad": ("Invalid", 400), "down": ("Unavailable", 503)}
+    for txn_id in statuses:
+        outbox.put({"txn_id": txn_id})
+    assert outbox.drain(lambda data: statuses[data["txn_id"]]) == 3
+
+    rows = {status: (attempts, next_attempt_at) for _, status, attempts, next_attempt_at in queued(outbox)}
+    assert set(rows) == {"failed", "pending"}  # 'ok' was deleted
+    attempts, next_attempt_at = rows["pending"]
+    assert attempts == 1
+    assert next_attempt_at > time.time() + 60  # backed off, not retried in the same drain
+    assert outbox.stats()["processed"] == 1
+
+def test_handler_exception_is_retried(outbox):
+    outbox.put({"txn_id": "x"})
+    def boom(data):
+        raise RuntimeError("network")
+    outbox.drain(boom)
+    (_, status, attempts, _), = queued(outbox)
+    assert (status, attempts) == ("pending", 1)
+
+def test_backoff_grows_and_gives_up(outbox, monkeypatch):
+    monkeypatch.setattr(paypal, "OUTBOX_MAX_ATTEMPTS", 3)
+    outbox_id = outbox.put({"txn_id": "x"})
+    delays = []
+    for _ in range(3):
+        outbox.db.execute("UPDATE ipn_outbox SET next_attempt_at = 0 WHERE id = ?", (outbox_id,))
+        outbox.drain(lambda data: ("Unavailable", 503))
+        (_, status, attempts, next_attempt_at), = queued(outbox)
+        delays.append(next_attempt_at - time.time())
+    assert status == "failed"
+    assert attempts == 3
+    assert delays[1] > delays[0] * 1.5
+
+def test_leased_ipn_is_not_handed_out_twice(outbox, tmp_path):
+    other = IPNOutbox(str(tmp_path / "payments.db"))
+    try:
+        outbox.put({"txn_id": "x"})
+        assert len(outbox._lease_due()) == 1
+        assert other._lease_due() == []
+        # The lease runs out if the verifier holding it dies
+        outbox.db.execute("UPDATE ipn_outbox SET next_attempt_at = 0")
+        assert [data for _, data, _ in other._lease_due()] == [{"txn_id": "x"}]
+    finally:
+        other.db.close()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from price_history import PriceHistory
+
+WINDOWS = {"1m": 60, "3m": 180}
+
+def make_history(slots=10, max_coins=4):
+    return PriceHistory(slots, max_coins, path=None)
+
+def test_momentum_over_windows():
+    history = make_history()
+    for minute, price in enumerate([100, 110, 120, 150]):
+        history.append(["pepe"], [price], [1000 + minute * 100], timestamp=minute * 60)
+    result = history.momentum(["pepe"], WINDOWS)
+    assert result["change_1m"][0] == pytest.approx(25.0)
+    assert result["change_3m"][0] == pytest.approx(50.0)
+    assert result["volume_change_3m"][0] == pytest.approx(30.0)
+
+def test_window_longer_than_history_is_nan():
+    history = make_history()
+    history.append(["pepe"], [1.0], [1.0], timestamp=60)
+    history.append(["pepe"], [2.0], [1.0], timestamp=120)
+    result = history.momentum(["pepe"], WINDOWS)
+    assert result["change_1m"][0] == pytest.approx(100.0)
+    assert np.isnan(result["change_3m"][0])
+
+def test_unknown_and_late_coins_are_nan():
+    history = make_history()
+    history.append(["pepe"], [1.0], [1.0], timestamp=0)
+    history.append(["pepe", "bonk"], [2.0, 5.0], [1.0, 1.0], timestamp=60)
+    result = history.momentum(["bonk", "doge", "pepe"], WINDOWS)
+    assert np.isnan(result["change_1m"][0])  # bonk has no price a minute ago
+    assert np.isnan(result["change_1m"][1])  # never seen
+    assert result["change_1m"][2] == pytest.approx(100.0)
+
+def test_stale_ticks_are_rejected():
+    history = make_history()
+    assert history.append(["pepe"], [1.0], [1.0], timestamp=60)
+    assert not history.append(["pepe"], [2.0], [1.0], timestamp=60)
+    assert history.count == 1
+
+def test_ring_buffer_wraps():
+    history = make_history(slots=3)
+    for minute in range(5):
+        history.append(["pepe"], [float(minute + 1)], [1.0], timestamp=minute * 60)
+    assert history.count == 3
+    result = history.momentum(["pepe"], {"2m": 120, "4m": 240})
+    assert result["change_2m"][0] == pytest.approx((5 / 3 - 1) * 100)
+    assert np.isnan(result["change_4m"][0])  # overwritten
+
+def test_full_buffer_ignores_extra_coins():
+    history = make_history(max_coins=1)
+    history.append(["pepe", "bonk"], [1.0, 1.0], [1.0, 1.0], timestamp=0)
+    history.append(["pepe", "bonk"], [2.0, 2.0], [1.0, 1.0], timestamp=60)
+    assert history.columns == {"pepe": 0}
+    assert history.untracked == {"bonk"}
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "history.npz")
+    history = PriceHistory(10, 4, path)
+    history.append(["pepe"], [1.0], [1.0], timestamp=0)
+    history.append(["pepe"], [2.0], [1.0], timestamp=60)
+    history.save()
+    loaded = PriceHistory.load(path, 10, 4)
+    assert loaded.momentum(["pepe"], {"1m": 60})["change_1m"][0] == pytest.approx(100.0)
+    # A different shape starts over rather than misreading the arrays
+    assert PriceHistory.load(path, 10, 8).count == 0
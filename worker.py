@@ -0,0 +1,183 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/worker.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+
+class CommandQueue:
+    """Bounded queue of slow bot commands drained by a fixed pool of worker threads."""
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_QUEUE_SIZE, name: str = "commands"):
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._started_at = time.time()
+        self._start()
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} {self.name} workers (queue size {self._queue.maxsize})")
+
+    def submit(self, label: str, func: Callable, *args: Any, **kwargs: Any) -> bool:
+        """Queue a job without blocking. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait((label, func, args, kwargs, time.time()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"{self.name} queue full, rejected '{label}'")
+            return False
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            label, func, args, kwargs, queued_at = job
+            started = time.time()
+            with self._lock:
+                self._busy += 1
+            try:
+                func(*args, **kwargs)
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error(f"Job '{label}' failed: {str(e)}", exc_info=True)
+            finally:
+                duration = time.time() - started
+                with self._lock:
+                    self._busy -= 1
+                    self._busy_seconds += duration
+                logger.info(f"Job '{label}' waited {started - queued_at:.2f}s, ran {duration:.2f}s")
+                self._queue.task_done()
+
+    def stats(self) -> Dict:
+        """Queue depth and worker utilization for sizing the pool."""
+        with self._lock:
+            uptime = max(time.time() - self._started_at, 1e-9)
+            return {
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "utilization": self._busy / self.workers if self.workers else 0,
+                "avg_utilization": self._busy_seconds / (uptime * self.workers) if self.workers else 0,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected
+            }
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Let queued jobs finish, then stop the workers."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        logger.info(f"Stopped {self.name} workers")
+
+class ReplyHandoff:
+    """Passes a worker's reply back to the waiting webhook request, or to the outbound client after the deadline."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._reply = None
+        self._abandoned = False
+
+    def deliver(self, reply: Any) -> bool:
+        """Hand over a finished reply. Returns False if the webhook stopped waiting and the caller must send it."""
+        with self._lock:
+            if self._abandoned:
+                return False
+            self._reply = reply
+            self._ready.set()
+            return True
+
+    def wait(self, timeout: float) -> Optional[Any]:
+        """Wait up to `timeout` seconds. Returns None (and gives the reply up to the worker) on deadline."""
+        self._ready.wait(timeout)
+        with self._lock:
+            if self._ready.is_set():
+                return self._reply
+            self._abandoned = True
+            return None
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight execution."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {}
+
+    def do(self, key: str, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run `func` unless a call for `key` is already in flight, in which case wait for and share its result."""
+        with self._lock:
+            stats = self._stats.setdefault(key, {"calls": 0, "executions": 0, "coalesced": 0})
+            stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                stats["executions"] += 1
+            else:
+                stats["coalesced"] += 1
+
+        if not leader:
+            logger.info(f"Coalesced '{key}' onto in-flight call")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}